@@ -0,0 +1,92 @@
+"""
+Benchmark the memory the member and user caches take in the full and lean
+cache modes (see CACHE_MODE in core/bot.py).
+
+Each mode runs in its own process, which feeds synthetic GUILD_CREATE payloads
+into a client's connection state and reports the growth in RSS per 10k guilds.
+
+Usage: python benchmarks/cache_memory.py [--guilds 10000] [--members 50]
+"""
+from argparse import ArgumentParser
+import gc
+import os
+import random
+import subprocess
+import sys
+
+def rss() -> int:
+    # resident set size in bytes, linux only
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def guild_payload(guild_id: int, user_ids: list[int]) -> dict:
+    return {
+        "id": str(guild_id),
+        "name": f"guild {guild_id}",
+        "owner_id": str(user_ids[0]),
+        "member_count": len(user_ids),
+        "roles": [],
+        "emojis": [],
+        "stickers": [],
+        "channels": [
+            {"id": str(guild_id + 1), "type": 0, "name": "general", "position": 0, "permission_overwrites": []}
+        ],
+        "members": [
+            {
+                "user": {
+                    "id": str(user_id),
+                    "username": f"user{user_id % 100000}",
+                    "discriminator": "0",
+                    "avatar": None,
+                    "bot": user_id % 10 == 0,
+                },
+                "roles": [],
+                "joined_at": "2024-01-01T00:00:00+00:00",
+                "deaf": False,
+                "mute": False,
+            }
+            for user_id in user_ids
+        ],
+        "features": [],
+    }
+
+def measure(mode: str, guilds: int, members: int) -> None:
+    import discord
+
+    options = {"intents": discord.Intents(guilds=True, members=True, messages=True)}
+    if mode == "lean":
+        options |= {"member_cache_flags": discord.MemberCacheFlags.none(), "max_messages": None}
+    client = discord.Client(**options)
+    state = client._connection
+
+    # users are shared between guilds, like on a real bot
+    pool = random.sample(range(10**17, 10**18), max(members, guilds * members // 2))
+    gc.collect()
+    before = rss()
+    for index in range(guilds):
+        guild_id = 10**17 + index * 10
+        state._add_guild_from_data(guild_payload(guild_id, random.sample(pool, members)))
+    gc.collect()
+    grown = rss() - before
+    cached_members = sum(len(guild._members) for guild in state._guilds.values())
+    print(
+        f"{mode:<5} {guilds:>7,} guilds  {cached_members:>9,} members  {len(state._users):>9,} users"
+        f"  {grown / 2**20 * 10_000 / guilds:9.1f} MiB per 10k guilds"
+    )
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="cache_memory")
+    parser.add_argument("--guilds", type=int, default=10_000)
+    parser.add_argument("--members", type=int, default=50, help="members sent per guild")
+    parser.add_argument("--mode", choices=("full", "lean"), help="measure one mode in this process")
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args.guilds, args.members)
+    else:
+        # a fresh process per mode, so one mode's heap doesn't hide the other's
+        for mode in ("full", "lean"):
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--guilds", str(args.guilds), "--members", str(args.members)],
+                check=True,
+            )
@@ -0,0 +1,82 @@
+"""
+Benchmark the output formats of the media commands (see core/encode.py), the
+size and encode time of each format on a corpus of stills and animations.
+
+The corpus is a directory of images, or a few generated samples by default.
+
+Usage: python benchmarks/encode_formats.py [--corpus DIRECTORY] [--repeat 3]
+"""
+from argparse import ArgumentParser
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageSequence
+from core import encode
+
+def generated_corpus() -> dict[str, list[Image.Image]]:
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, 640)
+    # a smooth gradient with sensor-like noise, the worst case for a 256 colour palette
+    photo = Image.fromarray(
+        np.clip(
+            np.dstack([np.tile(x, (480, 1)), np.tile(x[:480, None], (1, 640)), np.full((480, 640), 128.0)])
+            + rng.normal(0, 12, (480, 640, 3)),
+            0,
+            255,
+        ).astype("uint8")
+    )
+    # flat colours and text, like a captioned meme
+    meme = Image.new("RGB", (640, 560), "white")
+    draw = ImageDraw.Draw(meme)
+    draw.rectangle((0, 80, 640, 560), fill=(70, 130, 180))
+    draw.ellipse((200, 200, 440, 440), fill=(250, 200, 40))
+    draw.text((20, 20), "when the benchmark finishes", fill="black", font_size=40)
+    # a sprite moving over a flat background, like most reaction gifs
+    sprite = []
+    for step in range(40):
+        frame = Image.new("RGB", (480, 360), (30, 31, 34))
+        ImageDraw.Draw(frame).ellipse((step * 10, 120, step * 10 + 100, 220), fill=(88, 101, 242))
+        sprite.append(frame)
+    # a photo panning, where every pixel changes every frame
+    pan = [photo.crop((step * 8, 0, step * 8 + 320, 240)) for step in range(30)]
+    return {"photo": [photo], "meme": [meme], "sprite animation": sprite, "photo animation": pan}
+
+def load_corpus(directory: str) -> dict[str, list[Image.Image]]:
+    corpus = {}
+    for name in sorted(os.listdir(directory)):
+        with Image.open(os.path.join(directory, name)) as image:
+            corpus[name] = [frame.copy() for frame in ImageSequence.Iterator(image)]
+    return corpus
+
+def run(frames: list[Image.Image], format: str, gif_preset: str, repeat: int) -> tuple[int, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output, _, _ = encode.encode_image(frames, format, gif_preset=gif_preset)
+        timings.append(time.perf_counter() - start)
+    return len(output), statistics.median(timings)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="encode_formats")
+    parser.add_argument("--corpus", help="a directory of images and animations")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generated_corpus()
+    for name, frames in corpus.items():
+        animated = len(frames) > 1
+        print(f"{name} ({frames[0].width}x{frames[0].height}, {len(frames)} frame{'s' if animated else ''})")
+        variants = [("gif", preset) for preset in ("fast", "quality")] + [("webp", "fast")]
+        variants.append(("apng", "fast") if animated else ("png", "fast"))
+        for format, preset in variants:
+            size, seconds = run(frames, format, preset, args.repeat)
+            label = f"{format} ({preset})" if format == "gif" else format
+            print(f"  {label:<15} {size / 1024:9.1f}KB {seconds * 1000:9.1f}ms")
+        # what the commands send by default
+        _, _, stats = encode.encode_image(frames, "auto")
+        print(f"  auto picks {stats['format']}")
@@ -0,0 +1,73 @@
+"""
+Benchmark UserModel lookups by user_id with and without the indexes added in
+migration 2 (see core/migrations.py).
+
+Usage: python benchmarks/user_lookup.py [--sizes 10000 100000 1000000] [--lookups 500]
+"""
+from argparse import ArgumentParser
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+SCHEMA = """
+CREATE TABLE "user" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "user_id" BIGINT NOT NULL,
+    "user_name" VARCHAR(70) NOT NULL,
+    "user_discriminator" VARCHAR(4) NOT NULL,
+    "notes" JSON NOT NULL,
+    "baned" INT NOT NULL DEFAULT 0,
+    "commands_used" INT NOT NULL DEFAULT 0
+);
+"""
+INDEXES = """
+CREATE UNIQUE INDEX "uid_user_user_id" ON "user" ("user_id");
+CREATE INDEX "idx_user_commands_used" ON "user" ("commands_used");
+"""
+
+def populate(conn: sqlite3.Connection, size: int) -> list[int]:
+    # discord snowflakes are 64 bit, so use random ids of a similar size
+    user_ids = random.sample(range(10**17, 10**18), size)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        'INSERT INTO "user" ("user_id", "user_name", "user_discriminator", "notes", "commands_used") '
+        "VALUES (?, 'user', '0', '{}', ?)",
+        ((user_id, random.randint(0, 50)) for user_id in user_ids),
+    )
+    conn.commit()
+    return user_ids
+
+def time_lookups(conn: sqlite3.Connection, user_ids: list[int], lookups: int) -> list[float]:
+    timings = []
+    for user_id in random.choices(user_ids, k=lookups):
+        start = time.perf_counter()
+        conn.execute('SELECT * FROM "user" WHERE "user_id" = ? LIMIT 1', (user_id,)).fetchone()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def report(size: int, label: str, timings: list[float]) -> None:
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"{size:>9,} {label:<10} mean {statistics.mean(timings):9.3f}ms"
+        f"  p50 {statistics.median(timings):9.3f}ms  p99 {p99:9.3f}ms"
+    )
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="user_lookup")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            conn = sqlite3.connect(os.path.join(directory, "database.db"))
+            user_ids = populate(conn, size)
+            # full table scans get slow quickly, so sample fewer of them
+            report(size, "no index", time_lookups(conn, user_ids, max(20, args.lookups // (size // 10_000))))
+            conn.executescript(INDEXES)
+            report(size, "indexed", time_lookups(conn, user_ids, args.lookups))
+            conn.close()
@@ -2,13 +2,14 @@ import discord
 from core import Cog, Context
 import concurrent.futures
 import random
-from gradio_client import Client as GradioClient
 import asyncio
 import os
-import requests
 import json
 
 def ai_image_gen(prompt, enhancer, img2img, img_seed, img_strength, img_steps): # blocking function
+    import requests
+    from gradio_client import Client as GradioClient
+
     if prompt == None:
         # read config.json
         try:
@@ -1,4 +1,5 @@
 import discord
+from time import monotonic
 from discord.utils import utcnow
 
 from core import Cog, Context
@@ -40,6 +41,38 @@ class HelpSelect(discord.ui.Select):
         )
 
 class Help(Cog):
+    # how long the server and member counts in the help embed are reused for
+    counts_ttl = 60
+
+    def __init__(self, bot) -> None:
+        super().__init__(bot)
+        self.embed: discord.Embed | None = None
+        self.counted_at = 0.0
+
+    def get_embed(self) -> discord.Embed:
+        # build the embed once and only refresh the fields that change
+        if self.embed is None:
+            assert self.bot.user
+            self.embed = discord.Embed(
+                title="Utility Belt",
+                description=(
+                    "Welcome to Utility Belt!\n"
+                    "Choose a category from the dropdown below to see the related commands."
+                ),
+                colour=0x5865F2,
+            )
+            self.embed.set_thumbnail(url=self.bot.user.display_avatar.url)
+            self.embed.add_field(name="Server Count", value="0")
+            self.embed.add_field(name="Member Count", value="0")
+            self.embed.add_field(name="Ping", value="0ms")
+        if monotonic() - self.counted_at > self.counts_ttl:
+            totals = self.bot.get_totals()
+            self.embed.set_field_at(0, name="Server Count", value=str(totals["guild_count"]))
+            self.embed.set_field_at(1, name="Member Count", value=str(totals["guild_member_total"]))
+            self.counted_at = monotonic()
+        self.embed.set_field_at(2, name="Ping", value=f"{self.bot.latency*1000:.2f}ms")
+        return self.embed
+
     @discord.slash_command(
         integration_types={
         discord.IntegrationType.guild_install,
@@ -49,25 +82,7 @@ class Help(Cog):
     async def help_command(self, ctx: Context):
         """Get help about the bot, a command or a command category."""
         await ctx.defer()
-        assert self.bot.user
-        embed = discord.Embed(
-            title="Utility Belt",
-            description=(
-                "Welcome to Utility Belt!\n"
-                "Choose a category from the dropdown below to see the related commands."
-            ),
-            colour=0x5865F2,
-        )
-        embed.set_thumbnail(url=self.bot.user.display_avatar.url)
-        embed.add_field(name="Server Count", value=str(len(self.bot.guilds)))
-        embed.add_field(
-            name="Member Count",
-            value=str(sum(guild.member_count for guild in self.bot.guilds)),
-            #value=str(len(self.bot.users)),
-        )
-        embed.add_field(name="Ping", value=f"{self.bot.latency*1000:.2f}ms")
-
-        await ctx.respond(embed=embed, view=discord.ui.View(HelpSelect(self)))
+        await ctx.respond(embed=self.get_embed(), view=discord.ui.View(HelpSelect(self)))
 
 def setup(bot):
     bot.add_cog(Help(bot))
@@ -2,24 +2,84 @@ import discord
 import os
 import asyncio
 from functools import partial
-from core import Cog, Context, utils
-from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageSequence
+from core import Cog, Context, encode, ffmpeg, imgur, ingest, upload, utils
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from tempfile import NamedTemporaryFile
+import aiofiles
 import aiohttp
 import datetime
-import yt_dlp
-from yt_dlp.utils import ExtractorError, DownloadError
-import pyimgur
-from os import getenv
 import re
 
-async def image_to_gif(image, url):
+# the working resolution of each command, outputs are viewed at chat size so there's no point going bigger
+IMAGE_TO_GIF_POLICY = ingest.IngestPolicy(max_side=1024)
+SPEECH_BUBBLE_POLICY = ingest.IngestPolicy(max_side=1024)
+CAPTION_POLICY = ingest.IngestPolicy(max_side=800, max_frames=150)
+# the longest clip video-to-gif converts when no duration is given
+MAX_GIF_SECONDS = 30
+
+# the upload limit of each server boost tier, py-cord still reports the old 25MiB for tiers 0 and 1
+UPLOAD_LIMITS = {0: 10 * 2**20, 1: 10 * 2**20, 2: 50 * 2**20, 3: 100 * 2**20}
+
+def upload_limit(ctx: Context) -> int:
+    """The most bytes a file sent in reply to a command can have"""
+    # outside of a server (user installs) only the base limit applies
+    if not ctx.guild:
+        return UPLOAD_LIMITS[0]
+    return min(ctx.guild.filesize_limit, UPLOAD_LIMITS.get(ctx.guild.premium_tier, UPLOAD_LIMITS[0]))
+
+async def write_temp_file(output: bytes, suffix: str) -> discord.File:
+    """Write an output to a temporary file without blocking the event loop"""
+    with NamedTemporaryFile(prefix="utilitybelt_", suffix=suffix, delete=False) as temp_file:
+        path = temp_file.name
+    async with aiofiles.open(path, "wb") as file:
+        await file.write(output)
+    return discord.File(fp=path)
+
+async def cached_transform(cache, data, operation, params, render):
+    """Return render()'s output file, or a copy of the output from the last time this input was transformed the same way"""
+    if cache is None:
+        return await render()
+    key = cache.key(data, operation, **params)
+    if (cached := await cache.get(key)) is not None:
+        output, suffix = cached
+        return await write_temp_file(output, suffix)
+    file = await render()
+    async with aiofiles.open(file.fp.name, "rb") as output:
+        await cache.put(key, await output.read(), os.path.splitext(file.fp.name)[1])
+    return file
+
+async def write_output(frames, format="auto", durations=None, gif_preset="fast", max_bytes=None, candidates=None):
+    """Encode frames in the executor and write them to a temporary file"""
+    loop = asyncio.get_running_loop()
+    output, suffix, stats = await loop.run_in_executor(
+        None, partial(encode.encode_image, frames, format, durations, gif_preset, max_bytes, candidates)
+    )
+    sizes = ", ".join(f"{name} {size / 1024:.0f}KB" for name, size in stats["sizes"].items())
+    print(
+        f"Encoded {stats['frames']} frame(s) as {stats['format']} in {stats['seconds'] * 1000:.0f}ms ({sizes})"
+    )
+    return await write_temp_file(output, suffix)
+
+async def image_to_gif(session, image, url, cache=None, preset="fast", max_bytes=None, format="gif"):
     """Convert an image from a URL to a gif and return it as a file path"""
-    image = await utils.image_or_url(image, url)
-    with NamedTemporaryFile(prefix="utilitybelt_", suffix=".gif", delete=False) as temp_gif:
-        image.save(temp_gif, format="PNG", save_all=True, append_images=[image])
-        temp_gif.seek(0)
-        return discord.File(fp=temp_gif.name)
+    data = await utils.image_bytes_or_url(session, image, url, IMAGE_TO_GIF_POLICY)
+
+    async def render():
+        image = await utils.decode_image(data, IMAGE_TO_GIF_POLICY)
+        # animations are passed through frame by frame
+        if getattr(image, "is_animated", False):
+            loop = asyncio.get_running_loop()
+            frames = await loop.run_in_executor(None, partial(list, ingest.iter_frames(image, IMAGE_TO_GIF_POLICY)))
+        else:
+            frames = [image]
+        # a gif that can be saved to the gif picker is the point, other formats are opt in,
+        # and auto only weighs up the animated formats
+        return await write_output(frames, format, None, preset, max_bytes, candidates=encode.INLINE_ANIMATED)
+
+    return await cached_transform(
+        cache, data, "image_to_gif",
+        {"policy": IMAGE_TO_GIF_POLICY, "preset": preset, "max_bytes": max_bytes, "format": format}, render
+    )
 
 async def get_user_avatar(user: discord.User):
     """Get a user's avatar"""
@@ -29,31 +89,44 @@ async def get_user_avatar(user: discord.User):
     return user_avatar
 
 
-async def speech_bubble(image, url, overlay_y):
+async def speech_bubble(session, image, url, overlay_y, cache=None, format="auto"):
     """Add a speech bubble to an image"""
-    overlay = "assets/speechbubble.png"
-    # Use context manager to ensure file is properly closed
-    with Image.open(overlay) as overlay_img:
-        overlay = overlay_img.convert("RGBA").copy()
+    data = await utils.image_bytes_or_url(session, image, url, SPEECH_BUBBLE_POLICY)
 
-    image = await utils.image_or_url(image, url)
-    image = image.convert("RGBA")
+    def draw_frame():
+        # decoding and compositing block, so this runs in the executor
+        overlay = "assets/speechbubble.png"
+        # Use context manager to ensure file is properly closed
+        with Image.open(overlay) as overlay_img:
+            overlay = overlay_img.convert("RGBA").copy()
 
-    overlay = overlay.resize((image.width, int(image.height * (overlay_y / 10))))
+        # animations come back from open_image unscaled, only the first frame is used and it's scaled here
+        image = next(ingest.iter_frames(ingest.open_image(data, SPEECH_BUBBLE_POLICY), SPEECH_BUBBLE_POLICY))
+        image = image.convert("RGBA")
 
-    output = Image.new("RGBA", image.size)
-    output.paste(overlay, (0, 0), overlay)
+        overlay = overlay.resize((image.width, int(image.height * (overlay_y / 10))))
 
-    frame = ImageChops.composite(output, image, output)
-    frame = ImageChops.subtract(image, output)
+        output = Image.new("RGBA", image.size)
+        output.paste(overlay, (0, 0), overlay)
 
-    with NamedTemporaryFile(prefix="utilitybelt_",  suffix=".gif", delete=False) as temp_image:
-        frame.save(temp_image, format="PNG")
-        temp_image.seek(0)
-        return discord.File(fp=temp_image.name)
+        frame = ImageChops.composite(output, image, output)
+        return ImageChops.subtract(image, output)
+
+    async def render():
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(None, draw_frame)
+        return await write_output([frame], format)
+
+    return await cached_transform(
+        cache, data, "speech_bubble", {"overlay_y": overlay_y, "policy": SPEECH_BUBBLE_POLICY, "format": format}, render
+    )
 
 
 async def download_media_ytdlp(url, download_mode, video_quality, audio_format):
+    # yt_dlp takes a while to import, so it's only loaded when it's needed (or warmed up after ready)
+    import yt_dlp
+    from yt_dlp.utils import ExtractorError, DownloadError
+
     # Sanitize URL to fix common malformations
     # Fix double protocols like "https:https://" -> "https://"
     url = re.sub(r'^(https?:)+', r'\1', url)
@@ -71,6 +144,8 @@ async def download_media_ytdlp(url, download_mode, video_quality, audio_format):
         "nocheckcertificate": True,
         "cookiefile": ".cookies",
         "color": "never",
+        # the server's modification time would make the temp cleaner think the file is old
+        "updatetime": False,
     }
 
     # default options
@@ -129,103 +204,144 @@ async def download_media_ytdlp(url, download_mode, video_quality, audio_format):
 
     return discord.File(fp=filepath)
 
-async def upload_to_catbox(file): # pass a discord.File object
-    """Upload media to catbox.moe with curl and return the URL"""
+async def upload_to_catbox(file, session: aiohttp.ClientSession, progress=None) -> str: # pass a discord.File object
+    """Upload media to litterbox.catbox.moe for 72 hours and return the URL"""
     file_type = file.filename.split(".")[-1]
-    # Use context manager to ensure file is properly closed
-    with open(file.fp.name, "rb") as file_raw:
-        data = aiohttp.FormData()
-        data.add_field("reqtype", "fileupload")
-        data.add_field("time", "72h")
-        data.add_field("fileToUpload", file_raw, filename="file.{}".format(file_type))
-        async with aiohttp.ClientSession() as session:
-            async def post(data) -> str:
-                async with session.post("https://litterbox.catbox.moe/resources/internals/api.php", data=data) as response:
-                    text = await response.text()
-                    if not response.ok:
-                        return None
-                    return text
-            return await post(data)
-
-async def upload_to_imgur(file): # pass a discord.File object
-    """Upload media to Imgur using official API and return the URL"""
-    imgur_client_id = getenv("IMGUR_CLIENT_ID")
-    if not imgur_client_id:
-        raise discord.errors.ApplicationCommandError("Imgur API not configured")
+    link = await upload.upload_file(
+        session,
+        file.fp.name,
+        "file.{}".format(file_type),
+        fields={"reqtype": "fileupload", "time": "72h"},
+        progress=progress,
+    )
+    if not link.startswith("https://"):
+        raise upload.UploadError(f"litterbox.catbox.moe didn't return a link: {link[:200]}")
+    return link
 
-    # Run blocking operations in thread pool
-    loop = asyncio.get_event_loop()
-    try:
-        client = pyimgur.Imgur(imgur_client_id)
-        result = await loop.run_in_executor(
-            None,
-            lambda: client.upload_image(file.fp.name, title="Uploaded via Utility Belt")
-        )
-        return result.link
-    except Exception as e:
-        raise discord.errors.ApplicationCommandError(f"Failed to upload to Imgur: {str(e)}")
+async def upload_to_imgur(file, session: aiohttp.ClientSession, progress=None) -> str: # pass a discord.File object
+    """Upload media to Imgur using official API and return the URL"""
+    return await imgur.upload(session, file.fp.name, progress=progress)
 
-async def add_caption(image, url, caption_text):
+async def add_caption(session, image, url, caption_text, cache=None, format="auto"):
     """Add a caption above an image or gif, extending the canvas with a white background, wrapping text into multiple lines if needed."""
-    font_path = "assets/Futura Extra Bold Condensed.otf"
-    image = await utils.image_or_url(image, url)
-    is_animated = getattr(image, "is_animated", False)
-    frames = []
-    duration = image.info.get("duration", 100)
-    def process_frame(frame):
-        frame = frame.convert("RGBA")
-        width, height = frame.size
-        # Fixed bar height and font size (13% of image height)
-        bar_height = int(height * 0.13)
-        font_size = int(bar_height * 0.7)
-        font = ImageFont.truetype(font_path, font_size)
-        # Wrap text so each line fits the image width
-        words = caption_text.split()
-        lines = []
-        current_line = ""
-        draw = ImageDraw.Draw(frame)
-        for word in words:
-            test_line = current_line + (" " if current_line else "") + word
-            bbox = draw.textbbox((0,0), test_line, font=font)
-            if bbox[2] - bbox[0] <= width - 20:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-        if current_line:
-            lines.append(current_line)
-        total_bar_height = bar_height * len(lines)
-        new_img = Image.new("RGBA", (width, height + total_bar_height), (255,255,255,255))
-        # Paste original image below the bars
-        new_img.paste(frame, (0, total_bar_height), frame)
-        draw = ImageDraw.Draw(new_img)
-        for i, line in enumerate(lines):
-            bbox = draw.textbbox((0,0), line, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            x = (width - text_width) // 2
-            y = int(i * bar_height + (bar_height - text_height) // 2)
-            draw.text((x, y), line, font=font, fill="black")
-        return new_img.convert("RGB")
-    if is_animated:
-        for frame in ImageSequence.Iterator(image):
-            frames.append(process_frame(frame))
-        frames_p = [f.convert("P", dither=Image.NONE, palette=Image.ADAPTIVE) for f in frames]
-        with NamedTemporaryFile(prefix="utilitybelt_", suffix=".gif", delete=False) as temp_gif:
-            frames_p[0].save(temp_gif, save_all=True, append_images=frames_p[1:], format="GIF", duration=duration, loop=0, disposal=2)
-            temp_gif.seek(0)
-            return discord.File(fp=temp_gif.name)
-    else:
-        new_img = process_frame(image)
-        with NamedTemporaryFile(prefix="utilitybelt_", suffix=".png", delete=False) as temp_img:
-            new_img.save(temp_img, format="PNG")
-            temp_img.seek(0)
-            return discord.File(fp=temp_img.name)
+    data = await utils.image_bytes_or_url(session, image, url, CAPTION_POLICY)
+
+    def draw_frames():
+        # decoding, drawing every frame and loading the font all block, so this runs in the executor
+        font_path = "assets/Futura Extra Bold Condensed.otf"
+        image = ingest.open_image(data, CAPTION_POLICY)
+        is_animated = getattr(image, "is_animated", False)
+        frames = []
+        duration = image.info.get("duration", 100)
+        def process_frame(frame):
+            frame = frame.convert("RGBA")
+            width, height = frame.size
+            # Fixed bar height and font size (13% of image height)
+            bar_height = int(height * 0.13)
+            font_size = int(bar_height * 0.7)
+            font = ImageFont.truetype(font_path, font_size)
+            # Wrap text so each line fits the image width
+            words = caption_text.split()
+            lines = []
+            current_line = ""
+            draw = ImageDraw.Draw(frame)
+            for word in words:
+                test_line = current_line + (" " if current_line else "") + word
+                bbox = draw.textbbox((0,0), test_line, font=font)
+                if bbox[2] - bbox[0] <= width - 20:
+                    current_line = test_line
+                else:
+                    if current_line:
+                        lines.append(current_line)
+                    current_line = word
+            if current_line:
+                lines.append(current_line)
+            total_bar_height = bar_height * len(lines)
+            new_img = Image.new("RGBA", (width, height + total_bar_height), (255,255,255,255))
+            # Paste original image below the bars
+            new_img.paste(frame, (0, total_bar_height), frame)
+            draw = ImageDraw.Draw(new_img)
+            for i, line in enumerate(lines):
+                bbox = draw.textbbox((0,0), line, font=font)
+                text_width = bbox[2] - bbox[0]
+                text_height = bbox[3] - bbox[1]
+                x = (width - text_width) // 2
+                y = int(i * bar_height + (bar_height - text_height) // 2)
+                draw.text((x, y), line, font=font, fill="black")
+            return new_img.convert("RGB")
+        if is_animated:
+            durations = []
+            for frame in ingest.iter_frames(image, CAPTION_POLICY):
+                durations.append(frame.info.get("duration", duration))
+                frames.append(process_frame(frame))
+            return frames, durations
+        else:
+            return [process_frame(image)], None
+
+    async def render():
+        loop = asyncio.get_running_loop()
+        frames, durations = await loop.run_in_executor(None, draw_frames)
+        return await write_output(frames, format, durations)
+
+    return await cached_transform(
+        cache, data, "caption", {"caption_text": caption_text, "policy": CAPTION_POLICY, "format": format}, render
+    )
 
 class Media(Cog):
     """Media Commands"""
 
+    async def fit_to_upload_limit(self, ctx: Context, file: discord.File) -> discord.File:
+        """Re-encode a download that's too big to send, or return it as it is if that can't be done"""
+        await ctx.edit(content = f"Media is too big for discord, compressing it {self.bot.get_emojis('loading_emoji')}")
+        try:
+            with ctx.stage("transcode"):
+                path = await ffmpeg.fit_to_size(file.fp.name, upload_limit(ctx))
+        except ffmpeg.FFmpegError as e:
+            print(f"Couldn't compress {file.filename}: {e}")
+            return file
+        file.close()
+        os.remove(file.fp.name)
+        # keep the downloaded name, with the new extension
+        return discord.File(fp=path, filename=os.path.splitext(file.filename)[0] + os.path.splitext(path)[1])
+
+    async def download_attachment(self, attachment: discord.Attachment) -> discord.File:
+        """Download an attachment to a temporary file"""
+        # discord says how big attachments are, so there's no need to ask for one that's too big
+        if attachment.size > ingest.MAX_VIDEO_BYTES:
+            raise discord.errors.ApplicationCommandError(
+                f"Media is too big, the limit is {ingest.MAX_VIDEO_BYTES / 2**20:.0f}MB"
+            )
+        path = await ingest.download_to_file(
+            self.bot.http_session, attachment.url, os.path.splitext(attachment.filename)[1]
+        )
+        return discord.File(fp=path, filename=attachment.filename)
+
+    async def send_video_as_gif(self, ctx: Context, file: discord.File, fps=15, width=480, start=0.0, duration=None):
+        """Convert a downloaded video to a gif with ffmpeg and send it, or upload it to Imgur if that fails"""
+        try:
+            try:
+                with ctx.stage("process"):
+                    gif = await ffmpeg.video_to_gif(
+                        file.fp.name, fps, width, start, duration or MAX_GIF_SECONDS, upload_limit(ctx)
+                    )
+            except ffmpeg.FFmpegError:
+                # imgur makes its own gifs from videos, when it's set up
+                if not imgur.configured():
+                    raise
+                with ctx.stage("external_upload"):
+                    imgur_url = await upload_to_imgur(file, self.bot.http_session)
+                await ctx.edit(content = f"{imgur_url}")
+                return
+        finally:
+            # whatever happened, the download isn't needed anymore
+            file.close()
+            os.remove(file.fp.name)
+        try:
+            with ctx.stage("upload"):
+                await ctx.edit(content = f"", file=discord.File(fp=gif))
+        finally:
+            os.remove(gif)
+
     @discord.slash_command(
         integration_types={
         discord.IntegrationType.guild_install,
@@ -246,7 +362,23 @@ class Media(Cog):
         type=discord.Attachment,
         required=False
     )
-    async def image_to_gif_command(self, ctx: Context, image: discord.Attachment = None, url: str = None):
+    @discord.option(
+        "preset",
+        description="Fast, best looking, or small enough to upload",
+        type=str,
+        choices=list(encode.GIF_PRESETS),
+        required=False,
+        default="fast"
+    )
+    @discord.option(
+        "format",
+        description="The output format, gif by default, auto picks the smallest that plays in discord",
+        type=str,
+        choices=["gif", "webp", "apng", "auto"],
+        required=False,
+        default="gif"
+    )
+    async def image_to_gif_command(self, ctx: Context, image: discord.Attachment = None, url: str = None, preset: str = "fast", format: str = "gif"):
         """Convert an image to a gif using image_to_gif"""
         await ctx.respond(content = f"Converting image to gif {self.bot.get_emojis('loading_emoji')}")
         if not image and not url:
@@ -266,8 +398,10 @@ class Media(Cog):
             except discord.Forbidden:
                 raise discord.errors.ApplicationCommandError("Cannot access the referenced message")
 
-        file = await image_to_gif(image, url)
-        await ctx.edit(content = f"", file=file)
+        with ctx.stage("process"):
+            file = await image_to_gif(self.bot.http_session, image, url, self.bot.transform_cache, preset, upload_limit(ctx), format)
+        with ctx.stage("upload"):
+            await ctx.edit(content = f"", file=file)
         os.remove(file.fp.name)
 
     @discord.message_command(
@@ -283,8 +417,12 @@ class Media(Cog):
         await ctx.respond(content = f"Converting image to gif {self.bot.get_emojis('loading_emoji')}")
         if not message.attachments:
             raise discord.errors.ApplicationCommandError("No image attached to message")
-        file = await image_to_gif(message.attachments[0], message.attachments[0].url)
-        await ctx.edit(content = f"", file=file)
+        with ctx.stage("process"):
+            file = await image_to_gif(
+                self.bot.http_session, message.attachments[0], message.attachments[0].url, self.bot.transform_cache, max_bytes=upload_limit(ctx)
+            )
+        with ctx.stage("upload"):
+            await ctx.edit(content = f"", file=file)
         os.remove(file.fp.name)
 
     @discord.slash_command(
@@ -315,7 +453,15 @@ class Media(Cog):
         required=False,
         default=2
     )
-    async def speech_bubble_command(self, ctx: Context, image: discord.Attachment = None, url: str = None, user: discord.User = None, overlay_y: int = 2):
+    @discord.option(
+        "format",
+        description="The output format, auto picks the smallest that plays in discord",
+        type=str,
+        choices=["auto", "png", "webp", "gif"],
+        required=False,
+        default="auto"
+    )
+    async def speech_bubble_command(self, ctx: Context, image: discord.Attachment = None, url: str = None, user: discord.User = None, overlay_y: int = 2, format: str = "auto"):
         """Add a speech bubble to an image using speech_bubble"""
         await ctx.respond(content = f"Adding speech bubble to image {self.bot.get_emojis('loading_emoji')}")
         if not image and not url and not user:
@@ -324,8 +470,10 @@ class Media(Cog):
             image = await get_user_avatar(user)
         if overlay_y <= 0 or overlay_y > 10:
             raise discord.errors.ApplicationCommandError("Overlay y must be between 0 and 10")
-        file = await speech_bubble(image, url, overlay_y)
-        await ctx.edit(content = f"", file=file)
+        with ctx.stage("process"):
+            file = await speech_bubble(self.bot.http_session, image, url, overlay_y, self.bot.transform_cache, format)
+        with ctx.stage("upload"):
+            await ctx.edit(content = f"", file=file)
         os.remove(file.fp.name)
 
     @discord.message_command(
@@ -341,8 +489,10 @@ class Media(Cog):
         await ctx.respond(content = f"Adding speech bubble to image {self.bot.get_emojis('loading_emoji')}")
         if not message.attachments:
             raise discord.errors.ApplicationCommandError("No image attached to message")
-        file = await speech_bubble(message.attachments[0], message.attachments[0].url, 2)
-        await ctx.edit(content = f"", file=file)
+        with ctx.stage("process"):
+            file = await speech_bubble(self.bot.http_session, message.attachments[0], message.attachments[0].url, 2, self.bot.transform_cache)
+        with ctx.stage("upload"):
+            await ctx.edit(content = f"", file=file)
         os.remove(file.fp.name)
 
 
@@ -393,21 +543,35 @@ class Media(Cog):
         except IndexError:
             url_short = url
         await ctx.respond(content = f"Downloading media from {url_short} {self.bot.get_emojis('loading_emoji')}")
-        file = await download_media_ytdlp(url, format, video_quality, audio_format)
+        with ctx.stage("fetch"):
+            file = await download_media_ytdlp(url, format, video_quality, audio_format)
+        if os.path.getsize(file.fp.name) > upload_limit(ctx):
+            file = await self.fit_to_upload_limit(ctx, file)
         try:
-            await ctx.edit(content = f"", file=file)
+            with ctx.stage("upload"):
+                await ctx.edit(content = f"", file=file)
         except discord.errors.HTTPException:
-            await ctx.edit(content = f"Media is too big for discord, uploading to litterbox.catbox.moe instead {self.bot.get_emojis('loading_emoji')}")
-            catbox_link = await upload_to_catbox(file)
-            # get timestamp of 3 days from now in unix timestamp
-
-            timestamp = datetime.datetime.now() + datetime.timedelta(days=3)
-            timestamp = int(timestamp.timestamp())
-            timestamp = str(f"<t:{timestamp}:R>")
-            if catbox_link is not None:
-                await ctx.edit(content = f"Expiry: {timestamp} {catbox_link}")
+            message = f"Media is too big for discord, uploading to litterbox.catbox.moe instead {self.bot.get_emojis('loading_emoji')}"
+            await ctx.edit(content = message)
+
+            async def progress(sent: int, total: int) -> None:
+                # the payload throttles these, and a failed edit shouldn't stop the upload
+                try:
+                    await ctx.edit(content = f"{message} ({sent / total:.0%} of {total / 2**20:.1f}MB)")
+                except discord.errors.HTTPException:
+                    pass
+
+            try:
+                with ctx.stage("external_upload"):
+                    catbox_link = await upload_to_catbox(file, self.bot.http_session, progress)
+            except upload.UploadError as e:
+                await ctx.edit(content = f"Failed to upload to litterbox.catbox.moe: {e}")
             else:
-                await ctx.edit(content = f"Failed to upload to catbox.moe (file is probably still too big)")
+                # get timestamp of 3 days from now in unix timestamp
+                timestamp = datetime.datetime.now() + datetime.timedelta(days=3)
+                timestamp = int(timestamp.timestamp())
+                timestamp = str(f"<t:{timestamp}:R>")
+                await ctx.edit(content = f"Expiry: {timestamp} {catbox_link}")
         os.remove(str(file.fp.name))
 
     @discord.slash_command(
@@ -430,7 +594,42 @@ class Media(Cog):
         type=discord.Attachment,
         required=False
     )
-    async def video_to_gif_command(self, ctx: Context, media: discord.Attachment = None, url: str = None):
+    @discord.option(
+        "fps",
+        description="Frames per second",
+        type=int,
+        min_value=1,
+        max_value=30,
+        required=False,
+        default=15
+    )
+    @discord.option(
+        "width",
+        description="The width of the gif in pixels",
+        type=int,
+        min_value=64,
+        max_value=1280,
+        required=False,
+        default=480
+    )
+    @discord.option(
+        "start",
+        description="Where to start, in seconds",
+        type=float,
+        min_value=0,
+        required=False,
+        default=0
+    )
+    @discord.option(
+        "duration",
+        description=f"How many seconds to convert (default {MAX_GIF_SECONDS})",
+        type=float,
+        min_value=0.1,
+        max_value=120,
+        required=False,
+        default=None
+    )
+    async def video_to_gif_command(self, ctx: Context, media: discord.Attachment = None, url: str = None, fps: int = 15, width: int = 480, start: float = 0, duration: float = None):
         """Convert video to a gif"""
         await ctx.respond(content = f"Converting media to gif {self.bot.get_emojis('loading_emoji')}")
 
@@ -454,24 +653,13 @@ class Media(Cog):
 
         # Download the media if it's a URL
         if url:
-            file = await download_media_ytdlp(url, "auto", "auto", "auto")
+            with ctx.stage("fetch"):
+                file = await download_media_ytdlp(url, "auto", "auto", "auto")
         else:
-            # For attachments, we need to download them first
-            async with aiohttp.ClientSession() as session:
-                async with session.get(media.url) as response:
-                    if response.status != 200:
-                        raise discord.errors.ApplicationCommandError("Failed to download media")
-
-                    # Create a temporary file
-                    with NamedTemporaryFile(prefix="utilitybelt_", suffix=f".{media.filename.split('.')[-1]}", delete=False) as temp_file:
-                        temp_file.write(await response.read())
-                        temp_file.seek(0)
-                        file = discord.File(fp=temp_file.name)
-
-        # Upload to Imgur
-        imgur_url = await upload_to_imgur(file)
-        await ctx.edit(content = f"{imgur_url}")
-        os.remove(file.fp.name)
+            with ctx.stage("fetch"):
+                file = await self.download_attachment(media)
+
+        await self.send_video_as_gif(ctx, file, fps, width, start, duration)
 
     @discord.message_command(
         integration_types={
@@ -479,30 +667,18 @@ class Media(Cog):
             discord.IntegrationType.user_install,
         },
         name="video-to-gif",
-        description="Upload video/media to Imgur as a GIF"
+        description="Convert video to a gif"
     )
     async def video_to_gif_message_command(self, ctx: Context, message: discord.Message):
-        """Upload video/media to Imgur as a GIF"""
+        """Convert video to a gif"""
         await ctx.respond(content = f"Converting media to gif {self.bot.get_emojis('loading_emoji')}")
         if not message.attachments:
             raise discord.errors.ApplicationCommandError("No media attached to message")
 
-        # Download the attachment
-        async with aiohttp.ClientSession() as session:
-            async with session.get(message.attachments[0].url) as response:
-                if response.status != 200:
-                    raise discord.errors.ApplicationCommandError("Failed to download media")
-
-                # Create a temporary file
-                with NamedTemporaryFile(prefix="utilitybelt_", suffix=f".{message.attachments[0].filename.split('.')[-1]}", delete=False) as temp_file:
-                    temp_file.write(await response.read())
-                    temp_file.seek(0)
-                    file = discord.File(fp=temp_file.name)
-
-        # Upload to Imgur
-        imgur_url = await upload_to_imgur(file)
-        await ctx.edit(content = f"{imgur_url}")
-        os.remove(file.fp.name)
+        with ctx.stage("fetch"):
+            file = await self.download_attachment(message.attachments[0])
+
+        await self.send_video_as_gif(ctx, file)
 
     @discord.slash_command(
         integration_types={
@@ -530,11 +706,21 @@ class Media(Cog):
         type=discord.Attachment,
         required=False
     )
-    async def caption_command(self, ctx: Context, caption_text: str, image: discord.Attachment = None, url: str = None):
+    @discord.option(
+        "format",
+        description="The output format, auto picks the smallest that plays in discord",
+        type=str,
+        choices=list(encode.FORMATS),
+        required=False,
+        default="auto"
+    )
+    async def caption_command(self, ctx: Context, caption_text: str, image: discord.Attachment = None, url: str = None, format: str = "auto"):
         """Add a meme-style caption above an image or gif"""
         await ctx.respond(content = f"Adding caption... {self.bot.get_emojis('loading_emoji')}")
-        file = await add_caption(image, url, caption_text)
-        await ctx.edit(content = f"", file=file)
+        with ctx.stage("process"):
+            file = await add_caption(self.bot.http_session, image, url, caption_text, self.bot.transform_cache, format)
+        with ctx.stage("upload"):
+            await ctx.edit(content = f"", file=file)
         os.remove(file.fp.name)
 
 def setup(bot):
@@ -2,7 +2,6 @@ import discord
 from discord.utils import utcnow
 from core import Cog, Context
 import hashlib
-import random
 from core import models
 
 class Misc(Cog):
@@ -13,12 +12,23 @@ class Misc(Cog):
         peepee = "8" + "=" * peepeeSize + "D"
         return peepee
 
-    def get_random_user(self, ctx: Context):
-        random_user = random.choice(self.bot.users)
-        if random_user == ctx.author or random_user.bot:
-            return self.get_random_user(ctx)
-        else:
-            return random_user
+    async def get_random_user(self, ctx: Context):
+        if self.bot.user_index is not None:
+            if user_id := self.bot.user_index.sample(exclude=(ctx.author.id,)):
+                return await self.bot.get_or_fetch_user(user_id)
+            return None
+        # lean mode has no member cache to index, so sample the users the bot knows of from the database
+        tried = [ctx.author.id]
+        for _ in range(3):
+            user_ids = await models.UserModel.get_random_user_ids(exclude=tuple(tried))
+            if not user_ids:
+                return None
+            for user_id in user_ids:
+                user = await self.bot.get_or_fetch_user(user_id)
+                if user and not user.bot:
+                    return user
+            tried.extend(user_ids)
+        return None
         
     async def get_leaderboard_stats(self):
         user_data_list = await models.UserModel.get_top_users()
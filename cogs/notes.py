@@ -1,77 +1,81 @@
 import discord
+from bisect import insort
+from time import monotonic
 from core import Cog, Context, models
 
+# the most users to keep a title index for, the oldest entries are dropped first
+TITLE_INDEX_SIZE = 10000
+# seconds an index entry is trusted, other clusters write notes without telling this one
+TITLE_INDEX_TTL = 60
+
+async def get_note_titles(bot, user_id):
+    # Return the user's note titles from the in-memory index, loading them on first use
+    index = bot.cache.setdefault("note_titles", {})
+    entry = index.get(user_id)
+    if entry is None or entry[1] < monotonic():
+        # moved to the end, so the oldest loaded entries are the ones dropped
+        index.pop(user_id, None)
+        if len(index) >= TITLE_INDEX_SIZE:
+            index.pop(next(iter(index)))
+        entry = index[user_id] = (list(await models.NoteModel.get_titles(user_id)), monotonic() + TITLE_INDEX_TTL)
+    return entry[0]
+
+def cached_note_titles(bot, user_id):
+    # The user's note titles if they're in the index, for keeping it in step with this cluster's writes
+    entry = bot.cache.get("note_titles", {}).get(user_id)
+    return entry[0] if entry is not None else None
+
 async def note_write(ctx : Context, note_title, note_content):
-    # Create a new note
-    note = {
-        note_title: note_content
-    }
-
-    user = await models.UserModel.get_or_none(user_id = ctx.author.id)
-    if user:
-        user.notes = {**user.notes, **note}
-        await user.save()
-    else:
-        await models.UserModel.update_or_create(
-            user_id=ctx.author.id,
-            user_name=ctx.author.name,
-            user_discriminator=ctx.author.discriminator,
-            notes=note,
-            baned=False,
-            commands_used=1
-        )
+    # Create a new note, or overwrite the note with the same title
+    await models.NoteModel.write(ctx.author.id, note_title, note_content)
+    titles = cached_note_titles(ctx.bot, ctx.author.id)
+    if titles is not None and note_title not in titles:
+        insort(titles, note_title)
 
-async def get_notes(ctx : Context):
-    # Return a list of note titles for selection
-    user = await models.UserModel.get_or_none(user_id = ctx.author.id)
-    if user:
-        # return a dictionary of note titles and content
-        notes = user.notes.items()
-        return notes
-    else:
-        return None
+async def get_note(user_id, note_id):
+    # Return a single note with its full content
+    return await models.NoteModel.get_or_none(id = note_id, user_id = user_id)
     
 async def note_delete(ctx : Context, note_title):
     # Delete a note
-    user = await models.UserModel.get_or_none(user_id = ctx.author.id)
-    if user:
-        notes = user.notes
-        if note_title in notes:
-            del notes[note_title]
-            await user.save()
-            return True
-        else:
-            return False
-    else:
-        return False
+    deleted = await models.NoteModel.remove(ctx.author.id, note_title)
+    titles = cached_note_titles(ctx.bot, ctx.author.id)
+    if deleted and titles is not None and note_title in titles:
+        titles.remove(note_title)
+    return deleted
+
+async def note_search(ctx : Context, query):
+    # Return the notes that best match the query
+    return await models.NoteModel.search(ctx.author.id, query)
+
+async def note_title_autocomplete(ctx: discord.AutocompleteContext):
+    # Suggest the user's note titles, prefix matches first
+    titles = await get_note_titles(ctx.bot, ctx.interaction.user.id)
+    value = (ctx.value or "").lower()
+    prefix = [title for title in titles if title.lower().startswith(value)]
+    if len(prefix) >= 25:
+        return prefix[:25]
+    return (prefix + [title for title in titles if value in title.lower() and title not in prefix])[:25]
     
 
 class NoteSelect(discord.ui.Select):
-    def __init__(self, notes) -> None:
+    def __init__(self) -> None:
         super().__init__(
             placeholder="Choose a note",
-            options=[
-                discord.SelectOption(
-                    label=note[0], # Title
-                    description=note[1][:100]
-                )
-                for note in notes
-            ],
+            options=[discord.SelectOption(label="Loading")],
         )
 
     async def callback(self, interaction: discord.Interaction):
-        options = self.options
-        note_title = interaction.data["values"][0]
-        assert isinstance(note_title, str)
-        for option in options:
-            if option.label == note_title:
-                note_content = option.description
-                break
-        
-        # find which element in the list has value=note_title        
+        # only the selected note's content is loaded
+        note = await get_note(interaction.user.id, int(self.values[0]))
+        if note is None:
+            return await interaction.response.send_message(
+                content="Note not found",
+                ephemeral=True,
+            )
         embed = discord.Embed(
-            title=note_title,
-            description=note_content,
+            title=note.title,
+            description=note.content[:4096],
             color=0x5865F2,
         )
         await interaction.response.send_message(
@@ -79,6 +83,59 @@ class NoteSelect(discord.ui.Select):
             ephemeral=True,
         )
 
+class NoteBrowser(discord.ui.View):
+    """Browse a user's notes one page at a time"""
+
+    # a select menu can't hold more than 25 options
+    page_size = 25
+
+    def __init__(self, user_id: int) -> None:
+        super().__init__()
+        self.user_id = user_id
+        self.first_title = None
+        self.last_title = None
+        self.select = NoteSelect()
+        self.add_item(self.select)
+
+    async def load(self, after: str | None = None, before: str | None = None) -> bool:
+        """Load the page after or before a title, returns False if it's empty"""
+        # fetch one extra note to know if there's another page
+        page = await models.NoteModel.get_page(
+            self.user_id, after=after, before=before, limit=self.page_size + 1
+        )
+        more = len(page) > self.page_size
+        if before is not None:
+            page = page[-self.page_size:]
+            has_previous, has_next = more, True
+        else:
+            page = page[:self.page_size]
+            has_previous, has_next = after is not None, more
+        if not page:
+            return False
+
+        self.select.options = [
+            discord.SelectOption(label=title, value=str(note_id))
+            for note_id, title in page
+        ]
+        self.first_title = page[0][1]
+        self.last_title = page[-1][1]
+        self.previous_page.disabled = not has_previous
+        self.next_page.disabled = not has_next
+        return True
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary, row=1)
+    async def previous_page(self, button: discord.Button, interaction: discord.Interaction):
+        await self.load(before=self.first_title)
+        await interaction.response.edit_message(view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary, row=1)
+    async def next_page(self, button: discord.Button, interaction: discord.Interaction):
+        await self.load(after=self.last_title)
+        await interaction.response.edit_message(view=self)
+
 class Notes(Cog):
     """
     Notes commands
@@ -95,7 +152,8 @@ class Notes(Cog):
     @discord.option(
         "note_title",
         description="The title of the note",
-        type=str
+        type=str,
+        max_length=100
     )
     @discord.option(
         "note_content",
@@ -130,11 +188,10 @@ class Notes(Cog):
             ),
             colour=0x5865F2,
         )
-        embed.set_thumbnail(url=ctx.author.avatar.url)
-        notes = await get_notes(ctx)
-        if notes:
-            await ctx.respond(embed=embed, view=discord.ui.View(NoteSelect(notes))
-            )
+        embed.set_thumbnail(url=ctx.author.display_avatar.url)
+        view = NoteBrowser(ctx.author.id)
+        if await view.load():
+            await ctx.respond(embed=embed, view=view)
         else:
             await ctx.respond(content="No notes found")
 
@@ -150,7 +207,8 @@ class Notes(Cog):
     @discord.option(
         "note_title",
         description="The title of the note",
-        type=str
+        type=str,
+        autocomplete=note_title_autocomplete
     )
 
     async def note_delete_command(self, ctx: Context, note_title: str):
@@ -162,8 +220,37 @@ class Notes(Cog):
             await ctx.respond(content="Note not found")
 
 
+    @discord.slash_command(
+        integration_types={
+        discord.IntegrationType.guild_install,
+        discord.IntegrationType.user_install,
+        },
+        name="note-search",
+        description="Search your notes",
+    )
+    @discord.option(
+        "query",
+        description="The words to search for",
+        type=str
+    )
+
+    async def note_search_command(self, ctx: Context, query: str):
+        """Search your notes"""
+        await ctx.defer()
+        matches = await note_search(ctx, query)
+        if not matches:
+            return await ctx.respond(content="No matching notes found")
+        embed = discord.Embed(
+            title="Notes",
+            description=f"Best matches for `{query}`",
+            colour=0x5865F2,
+        )
+        for match in matches:
+            embed.add_field(name=match["title"], value=match["snippet"][:1024] or "\u200b", inline=False)
+        await ctx.respond(embed=embed)
+
+
 
 def setup(bot):
-    # bot.add_cog(Notes(bot))
-    return
+    bot.add_cog(Notes(bot))
 
@@ -1,30 +1,79 @@
+from discord.ext import commands
 from discord.ext.commands import command
-from jishaku.codeblocks import codeblock_converter
-from jishaku.modules import ExtensionConverter
 import discord
 from core import Cog, models
 from core import utils
+from core import profiler
+from core.cluster import RESTART_EXIT_CODE
+from functools import partial
 import aiohttp
+import asyncio
+import datetime
+import io
 import subprocess
 import os
 import sys
+import tracemalloc
+
+# jishaku pulls in yt_dlp when it's imported, so it's only imported once it's been warmed up
+
+def codeblock_converter(argument):
+    from jishaku.codeblocks import codeblock_converter
+    return codeblock_converter(argument)
+
+class ExtensionConverter(commands.Converter):
+    async def convert(self, ctx, argument):
+        from jishaku.modules import ExtensionConverter
+        return await ExtensionConverter().convert(ctx, argument)
+
+STATS_CHART_TITLES = {
+    "user_count": "Users",
+    "guild_count": "Guilds",
+    "total_command_count": "Commands",
+    "active_users": "Active Users",
+}
+
+def render_stats(rows: list) -> discord.File:
+    """Render the rows from StatsModel.query to a chart"""
+    import numpy as np
+    from core.charts import render_series
+
+    timestamps = np.array(
+        [
+            (row["bucket"] if isinstance(row["bucket"], datetime.datetime)
+             else datetime.datetime.combine(row["bucket"], datetime.time(), datetime.timezone.utc)).timestamp()
+            for row in rows
+        ],
+        dtype=np.float64,
+    )
+    series = {}
+    for metric, title in STATS_CHART_TITLES.items():
+        values = np.array([row.get(metric, {}).get("avg", np.nan) for row in rows], dtype=np.float64)
+        known = ~np.isnan(values)
+        series[title] = (timestamps[known], values[known])
+    return discord.File(render_series(series), filename="stats.png")
 
 class Owner(Cog, command_attrs={"hidden": True}):
-    def __init__(self, bot) -> None:
-        super().__init__(bot)
-        self.jishaku = bot.get_cog("Jishaku")
+    async def get_jishaku(self, ctx):
+        # jishaku is loaded in the background after the bot is ready
+        if (jishaku := self.bot.get_cog("Jishaku")) is None:
+            await ctx.reply("Still starting up, jishaku isn't loaded yet. Try again in a moment.")
+        return jishaku
 
     @command(name="eval")
     async def _eval(self, ctx, *, code):
-        await self.jishaku.jsk_python(ctx, argument=codeblock_converter(code))
+        if jishaku := await self.get_jishaku(ctx):
+            await jishaku.jsk_python(ctx, argument=codeblock_converter(code))
 
     @command(aliases=["reload"])
     async def load(self, ctx, *files: ExtensionConverter):
-        await self.jishaku.jsk_load(ctx, *files)
+        if jishaku := await self.get_jishaku(ctx):
+            await jishaku.jsk_load(ctx, *files)
 
     @command()
     async def unload(self, ctx, *files: ExtensionConverter):
-        await self.jishaku.jsk_unload(ctx, *files)
+        if jishaku := await self.get_jishaku(ctx):
+            await jishaku.jsk_unload(ctx, *files)
 
     @command()
     async def shutdown(self, ctx):
@@ -34,12 +83,17 @@ class Owner(Cog, command_attrs={"hidden": True}):
     @command()
     async def restart(self, ctx):
         await ctx.send("Restarting.")
+        if self.bot.cluster is not None:
+            # the supervisor starts this cluster again, the others keep running
+            await self.bot.close()
+            os._exit(RESTART_EXIT_CODE)
         os.execv(sys.executable, ['python'] + sys.argv)
 
     @command()
     async def pull(self, ctx, *to_load: ExtensionConverter):
-        await self.jishaku.jsk_git(ctx, argument=codeblock_converter("pull"))
-        await self.jishaku.jsk_load(ctx, *to_load)
+        if jishaku := await self.get_jishaku(ctx):
+            await jishaku.jsk_git(ctx, argument=codeblock_converter("pull"))
+            await jishaku.jsk_load(ctx, *to_load)
 
     @command()
     # set bot status in the format of {presence_text}
@@ -58,12 +112,10 @@ class Owner(Cog, command_attrs={"hidden": True}):
     @command(aliases=["percent"])
     # the percentage of users who have used a bot command (check if commandsUsed exists for each user)
     async def command_percentage(self, ctx):
-        user_data_list = await models.UserModel.all()
-        active_users = 0
-        for user_data in user_data_list:
-            if user_data.commands_used:
-                active_users += 1
-        percentage = (active_users / len(user_data_list)) * 100
+        totals = await models.UserModel.get_command_totals()
+        if not totals["user_count"]:
+            return await ctx.reply("No users have been recorded yet.")
+        percentage = (totals["active_users"] / totals["user_count"]) * 100
         await ctx.reply(f"{percentage:.2f}% of users have used a command.")
 
     @command()
@@ -72,6 +124,99 @@ class Owner(Cog, command_attrs={"hidden": True}):
         await utils.log_data(self.bot)
         await ctx.reply("Data logged to db.")
 
+    @command(name="stats")
+    async def stats_chart(self, ctx, days: int = 30):
+        # chart the logged stats, hourly for two weeks, daily for a year and weekly beyond that
+        bucket = "hour" if days <= 14 else "day" if days <= 365 else "week"
+        charts = self.bot.cache.setdefault("stats_charts", {})
+        # keyed by the last row logged, so a chart is redrawn once any cluster logs a new one
+        latest = await models.StatsModel.latest_id()
+        if charts.get(days, (None,))[0] != latest:
+            start = datetime.datetime.utcnow().date() - datetime.timedelta(days=days)
+            rows = await models.StatsModel.query(start, bucket=bucket, metrics=tuple(STATS_CHART_TITLES))
+            loop = asyncio.get_event_loop()
+            file = await loop.run_in_executor(None, partial(render_stats, rows))
+            charts[days] = (latest, file.fp.getvalue())
+        await ctx.reply(
+            f"Stats for the last {days} day{utils.s(days)} ({bucket}ly)",
+            file=discord.File(io.BytesIO(charts[days][1]), filename="stats.png"),
+        )
+
+    @command()
+    async def latency(self, ctx, *, command_name: str = None):
+        # command timings recorded since the bot started, in milliseconds
+        rows = self.bot.metrics.summary(command_name)
+        if not rows:
+            return await ctx.reply("No timings recorded yet.")
+        lines = [f"{'command':<20} {'stage':<15} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"]
+        for row in rows:
+            lines.append(
+                f"{row['command'][:20]:<20} {row['stage'][:15]:<15} {row['count']:>6}"
+                + "".join(f" {row[key] * 1000:>8.1f}" for key in ("p50", "p90", "p99", "max"))
+            )
+        report = "\n".join(lines)
+        if len(report) > 1900:
+            return await ctx.reply(file=discord.File(io.BytesIO(report.encode()), filename="latency.txt"))
+        await ctx.reply(f"```\n{report}\n```")
+
+    @command()
+    async def lag(self, ctx):
+        # event loop lag and the most recent stalls, with the stack of the last one
+        monitor = self.bot.monitor
+        file = None
+        if monitor.stalls:
+            file = discord.File(io.BytesIO(monitor.stalls[-1]["stack"].encode()), filename="stall.txt")
+        await ctx.reply(f"```\n{monitor.report()[:1900]}\n```", file=file)
+
+    @command()
+    async def cache(self, ctx):
+        # hit rates and sizes of the media transform cache
+        stats = self.bot.transform_cache.stats()
+        await ctx.reply(
+            f"Transform cache: {stats['hit_rate']:.1%} hit rate over {stats['lookups']} lookups"
+            f" ({stats['memory_hits']} memory, {stats['disk_hits']} disk)\n"
+            f"Memory: {stats['memory_entries']} outputs, {stats['memory_used'] / 2**20:.1f}MB"
+            f" | Disk: {stats['disk_entries']} outputs, {stats['disk_used'] / 2**20:.1f}MB"
+        )
+
+    @command()
+    async def profile(self, ctx, seconds: float = 10, output: str = "svg"):
+        # sample the stacks of the running bot, as a flame graph (svg) or collapsed stacks
+        seconds = min(max(seconds, 1), 60)
+        await ctx.reply(f"Profiling for {seconds:g} seconds.")
+        loop = asyncio.get_event_loop()
+        stacks = await loop.run_in_executor(None, partial(profiler.sample_stacks, seconds))
+        if output == "collapsed":
+            data, filename = profiler.collapse(stacks), "profile.txt"
+        else:
+            title = f"Utility Belt, {seconds:g}s, {sum(stacks.values())} samples"
+            data, filename = profiler.flame_graph(stacks, title), "profile.svg"
+        await ctx.reply(file=discord.File(io.BytesIO(data.encode()), filename=filename))
+
+    @command()
+    async def memsnap(self, ctx, action: str = "snapshot"):
+        # take a tracemalloc snapshot and compare it to the last one, or stop tracing
+        if action == "stop":
+            tracemalloc.stop()
+            self.bot.cache.pop("memory_snapshot", None)
+            return await ctx.reply("Stopped tracing allocations.")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            return await ctx.reply(
+                "Started tracing allocations, only memory allocated from now on is tracked.\n"
+                "Run this again to take the first snapshot."
+            )
+        loop = asyncio.get_event_loop()
+        snapshot = await loop.run_in_executor(None, profiler.take_snapshot)
+        previous = self.bot.cache.get("memory_snapshot")
+        self.bot.cache["memory_snapshot"] = snapshot
+        traced, peak = tracemalloc.get_traced_memory()
+        header = f"Traced {traced / 1024 ** 2:.1f} MiB (peak {peak / 1024 ** 2:.1f} MiB)"
+        if previous is None:
+            return await ctx.reply(f"{header}\nSnapshot taken, run this again to see what grew.")
+        diff = await loop.run_in_executor(None, partial(profiler.compare_snapshots, previous, snapshot))
+        await ctx.reply(f"{header}\n```\n{diff[:1800]}\n```")
+
     async def cog_check(self, ctx):
         return ctx.author.id in self.bot.owner_ids
 
@@ -23,4 +23,6 @@ class LogStats(Cog):
         await self.bot.wait_until_ready()
 
 def setup(bot):
-    bot.add_cog(LogStats(bot))
\ No newline at end of file
+    # the stats cover every cluster, so only one of them logs them
+    if bot.is_primary:
+        bot.add_cog(LogStats(bot))
\ No newline at end of file
@@ -47,4 +47,6 @@ class CleanTemp(Cog):
 
 
 def setup(bot):
-    bot.add_cog(CleanTemp(bot))
\ No newline at end of file
+    # the clusters share the temp directories, so only one of them cleans them
+    if bot.is_primary:
+        bot.add_cog(CleanTemp(bot))
\ No newline at end of file
@@ -1,14 +1,11 @@
 import discord
 from discord.utils import utcnow
 from core import Cog, Context, utils
-from pint import UnitRegistry
 import base64
 import codecs
-from qrcode import QRCode, constants
 import hashlib
 import os
 from PIL import Image
-from numpy import array
 import time
 import datetime
 import dateutil.parser
@@ -16,7 +13,6 @@ from dateutil.parser import ParserError
 from os import getenv
 import aiohttp
 from difflib import SequenceMatcher
-import pint
 
 def convert_str_to_unix_time(string):
     # Parse the string into a time
@@ -215,10 +211,21 @@ def hex_to_text(message):
     except ValueError:
         return None
     
+# building the unit registry parses pint's whole definitions file, so only do it once
+_unit_registry = None
+
+def get_unit_registry():
+    global _unit_registry
+    if _unit_registry is None:
+        from pint import UnitRegistry
+        _unit_registry = UnitRegistry()
+    return _unit_registry
+
 def unit_conversion(value: float, unit_from: str, unit_to: str):
+    import pint
 
     # Parse the units
-    ureg = UnitRegistry()
+    ureg = get_unit_registry()
     try:
         unit_from = ureg(unit_from)
         unit_to = ureg(unit_to)
@@ -241,6 +248,8 @@ def unit_conversion(value: float, unit_from: str, unit_to: str):
     return converted_value, unit_from, unit_to
 
 def qr_code_image_generator(text):
+    from qrcode import QRCode, constants
+
     qr = QRCode(
         version=1,
         error_correction=constants.ERROR_CORRECT_L,
@@ -256,6 +265,9 @@ def qr_code_image_generator(text):
 
 def qr_code_text_generator(input=None, invert=False, white='█', black=' ', version=1, border=1, correction='M'):
     """Converts a QR code to ASCII art."""
+    from numpy import array
+    from qrcode import QRCode, constants
+
     # generate/load image
     if input is None or not os.path.isfile(input):
         if input:
@@ -564,3 +576,4 @@ class Utilities(Cog):
 
 def setup(bot):
     bot.add_cog(Utilities(bot))
+    bot.warmups.append(get_unit_registry)
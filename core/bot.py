@@ -1,15 +1,46 @@
 from os import environ, getenv
+from time import perf_counter
+import asyncio
+import importlib
 from traceback import format_exception
 import discord
 from aiohttp import ClientSession
 from discord.ext import commands
 from tortoise import Tortoise
+from .cache import TransformCache
+from .cluster import ClusterIPC
 from .context import Context
+from .metrics import Metrics, serve_metrics
+from .migrations import migrate
+from .monitor import LoopMonitor
+from .utils import UserIndex
 from .models import BotModel, UserModel
 import aiofiles
 
+DATABASE_URL = "sqlite://data/database.db"
+DATABASE_MODULES = {"models": ["core.models"]}
+
+# modules that are slow to import, the cogs import them when they're first used
+# and they're warmed up in the background once the bot is ready
+WARM_IMPORTS = (
+    "jishaku",
+    "yt_dlp",
+    "pint",
+    "numpy",
+    "gradio_client",
+    "qrcode",
+    "requests",
+)
+
 class Bot(commands.AutoShardedBot):
-    def __init__(self) -> None:
+    def __init__(self, cluster: ClusterIPC | None = None, **options) -> None:
+        # lean mode caches no members and no messages, which saves most of the
+        # memory on large deployments, see benchmarks/cache_memory.py.
+        # features that need the caches fall back to sampling or counting instead
+        lean_cache = getenv("CACHE_MODE", "full").lower() == "lean"
+        if lean_cache:
+            options.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+            options.setdefault("max_messages", None)
         super().__init__(
             allowed_mentions=discord.AllowedMentions.none(),
             auto_sync_commands=False,
@@ -22,30 +53,144 @@ class Bot(commands.AutoShardedBot):
                 guilds=True,
             ),
             owner_ids=[512609720885051425],
+            **options,
         )
+        # set when this process is one of several clusters, see core/cluster.py
+        self.cluster = cluster
+        self.lean_cache = lean_cache
+        # kept up to date by the guild and member events, so reading them is free
+        self.guild_count = 0
+        self.guild_member_total = 0
+        # the non-bot users in this cluster's guilds, kept up to date by the member events.
+        # lean mode never sees most members, so it samples the database instead
+        self.user_index = None if lean_cache else UserIndex()
         self.cache: dict[str, dict] = {"example_list": {}}
+        # seconds spent in each phase of startup, printed once the bot is ready
+        self.startup_times: dict[str, float] = {}
+        self._startup_mark = perf_counter()
+        # extra blocking setup to run in the background once ready, such as building caches
+        self.warmups: list = []
+        self.metrics = Metrics()
+        # outputs of the media commands, keyed by their input and parameters
+        self.transform_cache = TransformCache(
+            f"cache/transforms/{cluster.cluster_id if cluster else 0}",
+            memory_bytes=int(getenv("TRANSFORM_CACHE_MEMORY_MB", 64)) * 2**20,
+            disk_bytes=int(getenv("TRANSFORM_CACHE_DISK_MB", 512)) * 2**20,
+        )
+        self.monitor = LoopMonitor(
+            self, threshold=float(getenv("LOOP_STALL_THRESHOLD_MS", 250)) / 1000
+        )
 
     def get_emojis(self, emoji: str) -> discord.Emoji:
         return getenv(emoji)
 
-    async def setup_tortoise(self) -> None:
-        await Tortoise.init(
-            db_url="sqlite://data/database.db", modules={"models": ["core.models"]}
+    @property
+    def is_primary(self) -> bool:
+        # the process that runs the once-per-bot tasks, like logging stats
+        return self.cluster is None or self.cluster.cluster_id == 0
+
+    def count_guilds(self) -> None:
+        # recount from scratch, the events keep the counts right after this
+        self.guild_count = len(self._connection._guilds)
+        self.guild_member_total = sum(
+            guild.member_count or 0 for guild in self._connection._guilds.values()
         )
-        await Tortoise.generate_schemas()
+        if self.user_index is not None:
+            self.user_index.clear()
+            for guild in self._connection._guilds.values():
+                for member in guild._members.values():
+                    self.user_index.add(member)
+
+    def get_local_totals(self) -> dict:
+        return {
+            "guild_count": self.guild_count,
+            "guild_member_total": self.guild_member_total,
+            # bot.users copies the whole user cache into a list
+            "user_count": len(self._connection._users),
+        }
+
+    def get_totals(self) -> dict:
+        # guild, member and user counts across every cluster
+        local = self.get_local_totals()
+        if self.cluster is None:
+            return local
+        self.cluster.publish(local)
+        totals = self.cluster.totals()
+        # a user in guilds on two clusters is cached by both, so the user count can't be summed
+        totals.pop("user_count", None)
+        return totals
+
+    async def publish_totals(self) -> None:
+        # keep this cluster's share of the totals fresh for the other clusters
+        while not self.is_closed():
+            self.cluster.publish(self.get_local_totals())
+            await asyncio.sleep(60)
+
+    def mark_startup(self, phase: str) -> None:
+        # record how long the phase since the last mark took
+        now = perf_counter()
+        self.startup_times.setdefault(phase, now - self._startup_mark)
+        self._startup_mark = now
+
+    def _warm_up(self) -> None:
+        # blocking, so this runs in a thread
+        for module in WARM_IMPORTS:
+            try:
+                importlib.import_module(module)
+            except ImportError as error:
+                print(f"Could not warm up {module}: {error}")
+        for warmup in self.warmups:
+            try:
+                warmup()
+            except Exception as error:
+                print(f"Warm up {getattr(warmup, '__name__', warmup)} failed: {error}")
+
+    async def warm_up(self) -> None:
+        start = perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._warm_up)
+        finally:
+            # jishaku imports yt_dlp, so it's loaded once that import is already warm,
+            # and loaded whatever happened to the other warm ups
+            if "jishaku" not in self.extensions:
+                self.load_extension("jishaku")
+        print(f"Warmed up in {perf_counter() - start:.2f}s")
+
+    async def setup_tortoise(self) -> None:
+        await Tortoise.init(db_url=DATABASE_URL, modules=DATABASE_MODULES)
+        # when clustered, the supervisor migrates once before any cluster starts
+        if self.cluster is None:
+            await migrate()
 
     async def start(self, token: str, *, reconnect: bool = True) -> None:
         await self.setup_tortoise()
+        self.mark_startup("database")
+        self.monitor.start()
+        if metrics_port := getenv("METRICS_PORT"):
+            # prometheus text dump, only reachable from this machine.
+            # each cluster has its own port, counting up from METRICS_PORT
+            port = int(metrics_port) + (self.cluster.cluster_id if self.cluster else 0)
+            self.metrics_runner = await serve_metrics(self.metrics, port)
         return await super().start(token, reconnect=reconnect)
 
+    async def login(self, token: str) -> None:
+        await super().login(token)
+        self.mark_startup("login")
+
     async def close(self) -> None:
+        self.monitor.stop()
+        if runner := getattr(self, "metrics_runner", None):
+            await runner.cleanup()
         await Tortoise.close_connections()
         return await super().close()
 
     async def get_application_context(
         self, interaction: discord.Interaction
     ) -> Context:
-        return Context(self, interaction)
+        ctx = Context(self, interaction)
+        # the command runs in this task, so stalls can be traced back to it
+        self.monitor.track(ctx)
+        return ctx
 
     @property
     def http_session(self) -> ClientSession:
@@ -71,7 +216,18 @@ class Bot(commands.AutoShardedBot):
             print (f"Presence updated to watching {bot_data['presence']['presence_text']}")
 
 
+        self.count_guilds()
         print(self.user, "is ready")
+        if "ready" not in self.startup_times:
+            self.mark_startup("ready")
+            print(
+                "Startup: "
+                + " | ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_times.items())
+                + f" | total {sum(self.startup_times.values()):.2f}s"
+            )
+            self.warm_up_task = asyncio.create_task(self.warm_up())
+            if self.cluster is not None:
+                self.publish_task = asyncio.create_task(self.publish_totals())
 
     async def on_application_command_error(self, ctx: Context, error: Exception):
         if isinstance(error, discord.ApplicationCommandInvokeError):
@@ -136,19 +292,14 @@ class Bot(commands.AutoShardedBot):
         # print the command used in the console with the options
         print(f"{ctx.author} ran /{ctx.command.qualified_name}")
         # find user in the database and add 1 to the commands_used for that user
-        user = await UserModel.get_or_none(user_id=ctx.author.id)
-        if user:
-            user.commands_used += 1
-            await user.save()
-        else:
-            await UserModel.update_or_create(
-                user_id=ctx.author.id,
-                user_name=ctx.author.name,
-                user_discriminator=ctx.author.discriminator,
-                notes={},
-                baned=False,
-                commands_used=1,
-            )
+        with ctx.stage("db"):
+            await UserModel.record_command(ctx.author.id, ctx.author.name, ctx.author.discriminator)
+
+    async def on_application_command_completion(self, ctx: Context) -> None:
+        # record how long the command took to finish, and when its last edit landed
+        if ctx.edited_at is not None:
+            self.metrics.record(ctx.command_name, "final_edit", ctx.edited_at - ctx.started_at)
+        self.metrics.record(ctx.command_name, "total", perf_counter() - ctx.started_at)
 
     async def on_message_edit(
         self, before: discord.Message, after: discord.Message
@@ -156,13 +307,37 @@ class Bot(commands.AutoShardedBot):
         if before.content != after.content:
             await self.process_commands(after)
 
+    async def on_guild_join(self, guild: discord.Guild) -> None:
+        self.guild_count += 1
+        self.guild_member_total += guild.member_count or 0
+        if self.user_index is not None:
+            for member in guild._members.values():
+                self.user_index.add(member)
+
     async def on_guild_remove(self, guild: discord.Guild) -> None:
-        pass
+        self.guild_count -= 1
+        self.guild_member_total -= guild.member_count or 0
+        if self.user_index is not None:
+            for member_id in guild._members:
+                self.user_index.remove(member_id)
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self.guild_member_total += 1
+        if self.user_index is not None:
+            self.user_index.add(member)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent) -> None:
+        # the raw event fires even when the member isn't cached
+        self.guild_member_total -= 1
+        if self.user_index is not None:
+            self.user_index.remove(payload.user.id)
     
     def run(
         self, debug: bool = False, cogs: list[str] | None = None, sync: bool = False
     ) -> None:
-        self.load_extensions("jishaku", *cogs or ("cogs", "cogs.task"))
+        self.mark_startup("init")
+        self.load_extensions(*cogs or ("cogs", "cogs.task"))
+        self.mark_startup("extensions")
         if sync:
             async def on_connect() -> None:
                 await self.sync_commands(delete_existing=not debug)
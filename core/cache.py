@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from functools import partial
+
+__all__ = ("TransformCache",)
+
+"""
+This module caches the outputs of the media commands.
+Outputs are keyed by a hash of the input bytes, the operation and its
+parameters, so the same meme captioned twice is only decoded and encoded
+once. Recent outputs are kept in memory, and older ones on disk, each tier
+with its own byte quota and least recently used eviction.
+"""
+
+class TransformCache:
+    """Two tier (memory and disk) LRU cache of transform outputs"""
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int) -> None:
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        # key -> (output, file suffix)
+        self.memory: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self.memory_used = 0
+        # key -> (path, size)
+        self.disk: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self.disk_used = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._load_disk()
+
+    def _load_disk(self) -> None:
+        # pick up the outputs a previous run left, least recently used first
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".partial"):
+                # left by a write that was cut off
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(entries):
+            self.disk[key] = (path, size)
+            self.disk_used += size
+
+    @staticmethod
+    def key(data: bytes, operation: str, **params) -> str:
+        """The cache key of an operation with these parameters applied to this input"""
+        digest = hashlib.sha256(data).hexdigest()
+        described = ",".join(f"{name}={params[name]!r}" for name in sorted(params))
+        return hashlib.sha256(f"{digest}:{operation}:{described}".encode()).hexdigest()
+
+    def _remember(self, key: str, output: bytes, suffix: str) -> None:
+        if len(output) > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key)[0])
+        self.memory[key] = (output, suffix)
+        self.memory_used += len(output)
+        while self.memory_used > self.memory_bytes:
+            self.memory_used -= len(self.memory.popitem(last=False)[1][0])
+
+    def _read(self, path: str) -> bytes:
+        with open(path, "rb") as file:
+            output = file.read()
+        # the modification time is the recency when the index is loaded again
+        os.utime(path)
+        return output
+
+    def _write(self, path: str, output: bytes) -> None:
+        # written under another name and renamed, so a reader never sees half a file
+        partial_path = f"{path}.{os.getpid()}.{id(output)}.partial"
+        try:
+            with open(partial_path, "wb") as file:
+                file.write(output)
+            os.replace(partial_path, path)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _remove(self, paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def get(self, key: str) -> tuple[bytes, str] | None:
+        """Return the (output, file suffix) stored under a key"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return self.memory[key]
+        if key in self.disk:
+            path, _ = self.disk[key]
+            self.disk.move_to_end(key)
+            loop = asyncio.get_running_loop()
+            try:
+                output = await loop.run_in_executor(None, partial(self._read, path))
+            except FileNotFoundError:
+                # cleaned up from outside the cache
+                self.disk_used -= self.disk.pop(key)[1]
+            else:
+                self.hits["disk"] += 1
+                suffix = os.path.splitext(path)[1]
+                self._remember(key, output, suffix)
+                return output, suffix
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, output: bytes, suffix: str) -> None:
+        self._remember(key, output, suffix)
+        if key in self.disk or len(output) > self.disk_bytes:
+            return
+        # the index is only changed on the event loop, the executor just does the file work
+        path = os.path.join(self.directory, key + suffix)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self._write, path, output))
+        # only indexed once the file is complete, and another put may have got there first
+        if key in self.disk:
+            return
+        self.disk[key] = (path, len(output))
+        self.disk_used += len(output)
+        evicted = []
+        while self.disk_used > self.disk_bytes:
+            _, (old_path, size) = self.disk.popitem(last=False)
+            self.disk_used -= size
+            evicted.append(old_path)
+        if evicted:
+            await loop.run_in_executor(None, partial(self._remove, evicted))
+
+    def stats(self) -> dict:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "hit_rate": (self.hits["memory"] + self.hits["disk"]) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_used": self.memory_used,
+            "disk_entries": len(self.disk),
+            "disk_used": self.disk_used,
+        }
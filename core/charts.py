@@ -0,0 +1,114 @@
+import datetime
+import io
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+__all__ = ("lttb", "render_series")
+
+"""
+This module renders time series to images for the owner commands.
+Series are downsampled to the width of the chart before they are drawn,
+so the drawing cost doesn't depend on how many rows were logged.
+"""
+
+BACKGROUND = (30, 31, 34)
+GRID = (60, 62, 68)
+TEXT = (219, 222, 225)
+LINE = (88, 101, 242)
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a series to `threshold` points using largest-triangle-three-buckets"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    # the first and last points are always kept, the rest are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    counts = np.diff(edges)
+    # the average point of each bucket, with the last point standing in after the final bucket
+    avg_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # twice the area of the triangle between the last selected point,
+        # each point in this bucket and the average of the next bucket
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+def _format_value(value: float) -> str:
+    for limit, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(value) >= limit:
+            return f"{value / limit:.1f}{suffix}"
+    return f"{value:.0f}"
+
+def _draw_panel(
+    draw: ImageDraw.ImageDraw,
+    box: tuple[int, int, int, int],
+    title: str,
+    x: np.ndarray,
+    y: np.ndarray,
+    font: ImageFont.ImageFont,
+) -> None:
+    left, top, right, bottom = box
+    draw.text((left, top), title, fill=TEXT, font=font)
+    top += 30
+    plot_left = left + 60
+    draw.rectangle((plot_left, top, right, bottom), outline=GRID)
+    if len(x) == 0:
+        draw.text((plot_left + 10, top + 10), "No data", fill=TEXT, font=font)
+        return
+
+    x, y = lttb(x, y, right - plot_left)
+    low, high = float(y.min()), float(y.max())
+    if high == low:
+        low, high = low - 1, high + 1
+    start, end = float(x[0]), float(x[-1])
+    span = (end - start) or 1.0
+
+    # scale into pixel space in one go
+    px = plot_left + (x - start) / span * (right - plot_left)
+    py = bottom - (y - low) / (high - low) * (bottom - top)
+    for fraction in (0.25, 0.5, 0.75):
+        grid_y = bottom - fraction * (bottom - top)
+        draw.line((plot_left, grid_y, right, grid_y), fill=GRID)
+    draw.text((left, top), _format_value(high), fill=TEXT, font=font)
+    draw.text((left, bottom - 20), _format_value(low), fill=TEXT, font=font)
+    draw.line(list(zip(px.tolist(), py.tolist())), fill=LINE, width=2)
+
+    for value, anchor in ((start, "la"), (end, "ra")):
+        label = datetime.datetime.fromtimestamp(value, datetime.timezone.utc).strftime("%Y-%m-%d")
+        draw.text((plot_left if anchor == "la" else right, bottom + 5), label, fill=TEXT, font=font, anchor=anchor)
+
+def render_series(
+    series: dict[str, tuple[np.ndarray, np.ndarray]], width: int = 1200, panel_height: int = 300
+) -> io.BytesIO:
+    """Render each (timestamps, values) series to its own panel and return a PNG"""
+    columns = 2
+    rows = -(-len(series) // columns)
+    panel_width = width // columns
+    image = Image.new("RGB", (width, rows * panel_height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=16)
+    for index, (title, (x, y)) in enumerate(series.items()):
+        row, column = divmod(index, columns)
+        box = (
+            column * panel_width + 15,
+            row * panel_height + 15,
+            (column + 1) * panel_width - 15,
+            (row + 1) * panel_height - 40,
+        )
+        _draw_panel(draw, box, title, x, y, font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from os import getenv
+import aiohttp
+
+__all__ = ("ClusterIPC", "Supervisor", "RESTART_EXIT_CODE")
+
+"""
+This module runs the bot as several processes, each with a share of the shards.
+The supervisor starts one process per cluster and restarts any that crash.
+The clusters share small stats dicts (guild counts and such) through a
+multiprocessing manager, so totals like the server count cover every cluster.
+"""
+
+# a cluster exiting with this code is restarted straight away, see the owner restart command
+RESTART_EXIT_CODE = 75
+
+class ClusterIPC:
+    """A cluster's handle on the stats shared between every cluster"""
+
+    def __init__(self, cluster_id: int, cluster_count: int, shared) -> None:
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        self.shared = shared
+
+    def publish(self, stats: dict) -> None:
+        # a manager call is a round trip over a local socket, well under a millisecond
+        self.shared[self.cluster_id] = stats
+
+    def totals(self) -> dict:
+        """Sum every cluster's latest stats"""
+        totals = {}
+        for stats in self.shared.values():
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+def run_cluster(
+    cluster_id: int,
+    cluster_count: int,
+    shard_ids: list[int],
+    shard_count: int,
+    shared,
+    debug: bool,
+    cogs: list[str] | None,
+    sync: bool,
+) -> None:
+    # the entry point of each cluster process
+    from dotenv import load_dotenv
+    from .bot import Bot
+    from .utils import setup_logging
+
+    load_dotenv(".env")
+    setup_logging(debug, filename=f"discord-{cluster_id}.log")
+    bot = Bot(
+        cluster=ClusterIPC(cluster_id, cluster_count, shared),
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+    )
+    # commands are global, so only one cluster needs to sync them
+    bot.run(debug=debug, cogs=cogs, sync=sync and cluster_id == 0)
+
+async def migrate_database() -> None:
+    # the clusters share one database, so it's migrated once before they start
+    from tortoise import Tortoise
+    from .bot import DATABASE_MODULES, DATABASE_URL
+    from .migrations import migrate
+
+    await Tortoise.init(db_url=DATABASE_URL, modules=DATABASE_MODULES)
+    try:
+        await migrate()
+    finally:
+        await Tortoise.close_connections()
+
+async def recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+class Supervisor:
+    """Start the clusters and restart them when they crash"""
+
+    # a cluster that stays up this long has its restart backoff reset
+    stable_after = 600
+    max_backoff = 60
+
+    def __init__(
+        self,
+        clusters: int,
+        shard_count: int | None = None,
+        debug: bool = False,
+        cogs: list[str] | None = None,
+        sync: bool = False,
+    ) -> None:
+        self.clusters = clusters
+        self.shard_count = shard_count
+        self.debug = debug
+        self.cogs = cogs
+        self.sync = sync
+        # spawn rather than fork, so no cluster inherits another's sockets or event loop
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: dict[int, multiprocessing.Process] = {}
+        self.started_at: dict[int, float] = {}
+        self.failures: dict[int, int] = {}
+        self.log = logging.getLogger("discord.cluster")
+
+    def shard_ids(self, cluster_id: int) -> list[int]:
+        # split the shards into contiguous, evenly sized runs
+        per_cluster, extra = divmod(self.shard_count, self.clusters)
+        start = cluster_id * per_cluster + min(cluster_id, extra)
+        return list(range(start, start + per_cluster + (cluster_id < extra)))
+
+    def start(self, cluster_id: int, shared) -> None:
+        process = self.context.Process(
+            target=run_cluster,
+            name=f"cluster-{cluster_id}",
+            args=(
+                cluster_id,
+                self.clusters,
+                self.shard_ids(cluster_id),
+                self.shard_count,
+                shared,
+                self.debug,
+                self.cogs,
+                self.sync,
+            ),
+        )
+        process.start()
+        self.processes[cluster_id] = process
+        self.started_at[cluster_id] = time.monotonic()
+        print(f"Started cluster {cluster_id} with shards {self.shard_ids(cluster_id)} (pid {process.pid})")
+
+    def run(self) -> None:
+        if self.shard_count is None:
+            token = getenv("DEBUG_TOKEN", getenv("TOKEN")) if self.debug else getenv("TOKEN")
+            self.shard_count = asyncio.run(recommended_shards(token))
+        self.clusters = min(self.clusters, self.shard_count)
+        asyncio.run(migrate_database())
+
+        with self.context.Manager() as manager:
+            shared = manager.dict()
+            for cluster_id in range(self.clusters):
+                self.start(cluster_id, shared)
+            restarts: dict[int, float] = {}
+            try:
+                while self.processes:
+                    time.sleep(1)
+                    for cluster_id, process in list(self.processes.items()):
+                        if process.is_alive() or cluster_id in restarts:
+                            continue
+                        shared.pop(cluster_id, None)
+                        if process.exitcode == 0:
+                            # shut down on purpose
+                            print(f"Cluster {cluster_id} shut down")
+                            del self.processes[cluster_id]
+                            continue
+                        if process.exitcode == RESTART_EXIT_CODE:
+                            delay = 0
+                        else:
+                            if time.monotonic() - self.started_at[cluster_id] > self.stable_after:
+                                self.failures[cluster_id] = 0
+                            self.failures[cluster_id] = self.failures.get(cluster_id, 0) + 1
+                            delay = min(self.max_backoff, 2 ** self.failures[cluster_id])
+                            self.log.error("Cluster %s exited with %s", cluster_id, process.exitcode)
+                        print(f"Cluster {cluster_id} exited with {process.exitcode}, restarting in {delay}s")
+                        restarts[cluster_id] = time.monotonic() + delay
+                    for cluster_id, when in list(restarts.items()):
+                        if time.monotonic() >= when:
+                            del restarts[cluster_id]
+                            self.start(cluster_id, shared)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                for process in self.processes.values():
+                    if process.is_alive():
+                        process.terminate()
+                for process in self.processes.values():
+                    process.join(10)
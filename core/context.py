@@ -1,3 +1,4 @@
+from time import perf_counter
 from discord import ApplicationContext, Color, Embed
 from discord.utils import utcnow
 
@@ -5,6 +6,43 @@ from .utils import BotMissingPermissions
 
 
 class Context(ApplicationContext):
+    def __init__(self, bot, interaction) -> None:
+        super().__init__(bot, interaction)
+        # timings for the command's latency metrics
+        self.started_at = perf_counter()
+        self.responded_at: float | None = None
+        self.edited_at: float | None = None
+
+    @property
+    def command_name(self) -> str:
+        return self.command.qualified_name if self.command else "unknown"
+
+    def stage(self, name: str):
+        """Time the body of a with block as a named stage of this command"""
+        return self.bot.metrics.timer(self.command_name, name)
+
+    def _mark_response(self) -> None:
+        if self.responded_at is None:
+            self.responded_at = perf_counter()
+            self.bot.metrics.record(
+                self.command_name, "first_response", self.responded_at - self.started_at
+            )
+
+    async def respond(self, *args, **kwargs):
+        message = await super().respond(*args, **kwargs)
+        self._mark_response()
+        return message
+
+    async def defer(self, *args, **kwargs) -> None:
+        await super().defer(*args, **kwargs)
+        self._mark_response()
+
+    async def edit(self, *args, **kwargs):
+        message = await super().edit(*args, **kwargs)
+        self._mark_response()
+        self.edited_at = perf_counter()
+        return message
+
     async def assert_permissions(self, **permissions: bool) -> None:
         if missing := [
             perm
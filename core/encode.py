@@ -0,0 +1,157 @@
+import io
+from time import perf_counter
+from PIL import Image, features
+
+__all__ = ("GIF_PRESETS", "FORMATS", "encode_gif", "encode_webp", "encode_png", "encode_image")
+
+"""
+This module encodes the outputs of the media commands.
+Encoding blocks, so run these in an executor.
+"""
+
+# the output formats the media commands offer, auto picks the smallest that discord plays inline
+FORMATS = ("auto", "gif", "webp", "apng", "png")
+# discord plays these inline, apng only shows its first frame
+INLINE_ANIMATED = ("gif", "webp")
+INLINE_STILL = ("png", "webp")
+SUFFIXES = {"gif": ".gif", "webp": ".webp", "apng": ".png", "png": ".png"}
+WEBP_QUALITY = 80
+
+# how each preset quantizes frames to the 256 colours a gif can have
+GIF_PRESETS = {
+    # one palette for the whole animation, no dithering
+    "fast": {"method": Image.Quantize.FASTOCTREE, "dither": Image.Dither.NONE, "shared_palette": True},
+    # a palette per frame with dithering, for photos and gradients
+    "quality": {
+        "method": Image.Quantize.LIBIMAGEQUANT if features.check("libimagequant") else Image.Quantize.MEDIANCUT,
+        "dither": Image.Dither.FLOYDSTEINBERG,
+        "shared_palette": False,
+    },
+    # fewer colours and then smaller frames until the output fits max_bytes
+    "small": {"method": Image.Quantize.MEDIANCUT, "dither": Image.Dither.NONE, "shared_palette": True},
+}
+# the colour counts and scales tried in turn by the small preset
+SMALL_STEPS = ((256, 1.0), (128, 1.0), (64, 1.0), (64, 0.75), (32, 0.75), (32, 0.5), (16, 0.5), (16, 0.25))
+
+def _quantize(
+    frame: Image.Image, colours: int, method: Image.Quantize, dither: Image.Dither, palette: Image.Image | None = None
+) -> Image.Image:
+    # gif transparency is a single palette index, so keep the last one free for it
+    transparent = frame.mode in ("RGBA", "LA", "PA") or "transparency" in frame.info
+    if transparent:
+        frame = frame.convert("RGBA")
+        alpha = frame.getchannel("A")
+        colours = min(colours, 255)
+    rgb = frame.convert("RGB")
+    if palette is not None:
+        quantized = rgb.quantize(palette=palette, dither=dither)
+    else:
+        quantized = rgb.quantize(colours, method=method, dither=dither)
+    if transparent:
+        quantized.paste(255, mask=alpha.point(lambda value: 255 if value < 128 else 0))
+        quantized.info["transparency"] = 255
+    return quantized
+
+def _palette_source(frames: list[Image.Image], samples: int = 16, side: int = 96) -> Image.Image:
+    # a strip of small copies of frames from across the animation, so one palette covers all of them
+    picked = frames[:: max(1, len(frames) // samples)][:samples]
+    strip = Image.new("RGBA", (side * len(picked), side))
+    for index, frame in enumerate(picked):
+        thumbnail = frame.convert("RGBA")
+        thumbnail.thumbnail((side, side))
+        strip.paste(thumbnail, (index * side, 0))
+    return strip
+
+def _encode(frames: list[Image.Image], durations: list[int], preset: dict, colours: int, scale: float) -> bytes:
+    if scale != 1.0:
+        frames = [
+            frame.resize((max(1, int(frame.width * scale)), max(1, int(frame.height * scale))), Image.Resampling.BILINEAR)
+            for frame in frames
+        ]
+    palette = None
+    if preset["shared_palette"] and len(frames) > 1:
+        palette = _quantize(_palette_source(frames), colours, preset["method"], Image.Dither.NONE)
+    quantized = [_quantize(frame, colours, preset["method"], preset["dither"], palette) for frame in frames]
+
+    buffer = io.BytesIO()
+    options = {"format": "GIF", "optimize": True}
+    if "transparency" in quantized[0].info:
+        options["transparency"] = 255
+    if len(quantized) > 1:
+        options |= {"save_all": True, "append_images": quantized[1:], "duration": durations, "loop": 0, "disposal": 2}
+    quantized[0].save(buffer, **options)
+    return buffer.getvalue()
+
+def encode_gif(
+    frames: list[Image.Image], durations: list[int] | None = None, preset: str = "fast", max_bytes: int | None = None
+) -> tuple[bytes, dict]:
+    """Encode frames to a gif with one of GIF_PRESETS, returning the gif and how it went"""
+    started = perf_counter()
+    durations = durations or [frame.info.get("duration", 100) for frame in frames]
+    settings = GIF_PRESETS[preset]
+    steps = SMALL_STEPS if preset == "small" and max_bytes else SMALL_STEPS[:1]
+    for colours, scale in steps:
+        output = _encode(frames, durations, settings, colours, scale)
+        if max_bytes is None or len(output) <= max_bytes:
+            break
+    return output, {
+        "preset": preset,
+        "frames": len(frames),
+        "colours": colours,
+        "scale": scale,
+        "bytes": len(output),
+        "seconds": perf_counter() - started,
+    }
+
+def encode_webp(frames: list[Image.Image], durations: list[int] | None = None) -> bytes:
+    buffer = io.BytesIO()
+    options = {"format": "WEBP", "quality": WEBP_QUALITY, "method": 4}
+    if len(frames) > 1:
+        durations = durations or [frame.info.get("duration", 100) for frame in frames]
+        options |= {"save_all": True, "append_images": frames[1:], "duration": durations, "loop": 0}
+    frames[0].save(buffer, **options)
+    return buffer.getvalue()
+
+def encode_png(frames: list[Image.Image], durations: list[int] | None = None) -> bytes:
+    # more than one frame makes an apng
+    buffer = io.BytesIO()
+    options = {"format": "PNG", "optimize": len(frames) == 1}
+    if len(frames) > 1:
+        durations = durations or [frame.info.get("duration", 100) for frame in frames]
+        options |= {"save_all": True, "append_images": frames[1:], "duration": durations, "loop": 0, "disposal": 1}
+    frames[0].save(buffer, **options)
+    return buffer.getvalue()
+
+def encode_image(
+    frames: list[Image.Image],
+    format: str = "auto",
+    durations: list[int] | None = None,
+    gif_preset: str = "fast",
+    max_bytes: int | None = None,
+    candidates: tuple[str, ...] | None = None,
+) -> tuple[bytes, str, dict]:
+    """Encode frames to one of FORMATS, returning the output, its file suffix and how it went"""
+    started = perf_counter()
+    durations = durations or [frame.info.get("duration", 100) for frame in frames]
+    if format == "auto":
+        # try each format discord plays inline and keep the smallest
+        candidates = candidates or (INLINE_ANIMATED if len(frames) > 1 else INLINE_STILL)
+    else:
+        candidates = (format,)
+
+    outputs = {}
+    for candidate in candidates:
+        if candidate == "gif":
+            outputs[candidate] = encode_gif(frames, durations, gif_preset, max_bytes)[0]
+        elif candidate == "webp":
+            outputs[candidate] = encode_webp(frames, durations)
+        else:
+            outputs[candidate] = encode_png(frames if candidate == "apng" else frames[:1], durations)
+    chosen = min(outputs, key=lambda candidate: len(outputs[candidate]))
+    return outputs[chosen], SUFFIXES[chosen], {
+        "format": chosen,
+        "frames": len(frames),
+        "bytes": len(outputs[chosen]),
+        "sizes": {candidate: len(output) for candidate, output in outputs.items()},
+        "seconds": perf_counter() - started,
+    }
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+from asyncio.subprocess import DEVNULL, PIPE
+from os import getenv
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import discord
+from .utils import keep_fresh
+
+__all__ = ("FFmpegError", "run", "probe", "video_to_gif", "fit_to_size")
+
+"""
+This module runs ffmpeg for the media commands.
+Every ffmpeg and ffprobe process goes through one semaphore, so only a few
+run at once however many commands are waiting, and each is killed if it
+runs past its timeout. The files a job works on are kept fresh for as long
+as it runs, so the temp cleaner doesn't remove them partway through.
+"""
+
+FFMPEG = getenv("FFMPEG_PATH", "ffmpeg")
+FFPROBE = getenv("FFPROBE_PATH", "ffprobe")
+# ffmpeg uses several threads itself, so leave room for the bot
+MAX_JOBS = int(getenv("FFMPEG_JOBS", max(1, (os.cpu_count() or 2) // 2)))
+TIMEOUT = float(getenv("FFMPEG_TIMEOUT", 120))
+
+_slots = asyncio.Semaphore(MAX_JOBS)
+
+# below this, video is too blurry to be worth sending
+MIN_VIDEO_BITRATE = 150_000
+# the tallest video fit_to_size makes for each total bitrate
+HEIGHTS = ((600_000, 360), (1_500_000, 480), (3_000_000, 720))
+
+class FFmpegError(discord.errors.ApplicationCommandError):
+    pass
+
+async def _execute(program: str, *args: str, timeout: float) -> bytes:
+    async with _slots:
+        try:
+            process = await asyncio.create_subprocess_exec(program, *args, stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+        except FileNotFoundError:
+            raise FFmpegError(f"{program} is not installed")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise FFmpegError(f"Conversion took longer than {timeout:.0f} seconds")
+    if process.returncode:
+        # the last line of the log says what went wrong
+        message = stderr.decode(errors="replace").strip().splitlines()
+        raise FFmpegError(f"Conversion failed: {message[-1] if message else process.returncode}")
+    return stdout
+
+async def run(*args: str, timeout: float = TIMEOUT) -> None:
+    """Run ffmpeg with these arguments in one of the job slots"""
+    await _execute(FFMPEG, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *args, timeout=timeout)
+
+async def probe(path: str, timeout: float = 30) -> dict:
+    """The duration (in seconds) and streams of a media file"""
+    output = await _execute(
+        FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path, timeout=timeout
+    )
+    info = json.loads(output)
+    return {
+        "duration": float(info.get("format", {}).get("duration") or 0),
+        "streams": info.get("streams", []),
+    }
+
+def _trim(start: float, duration: float | None) -> list[str]:
+    # before -i, so ffmpeg seeks instead of decoding up to the start
+    args = ["-ss", f"{start:g}"] if start else []
+    return args + (["-t", f"{duration:g}"] if duration else [])
+
+async def video_to_gif(
+    source: str,
+    fps: int = 15,
+    width: int = 480,
+    start: float = 0,
+    duration: float | None = None,
+    max_bytes: int | None = None,
+    attempts: int = 4,
+) -> str:
+    """Convert a video to a gif with a palette made for it, returning the gif's path"""
+    # with max_bytes, the gif is made again smaller and choppier until it fits
+    with NamedTemporaryFile(prefix="utilitybelt_", suffix=".gif", delete=False) as gif:
+        output = gif.name
+    try:
+        await _convert(source, output, fps, width, start, duration, max_bytes, attempts)
+    except BaseException:
+        os.remove(output)
+        raise
+    return output
+
+async def _convert(
+    source: str, output: str, fps: int, width: int, start: float, duration: float | None, max_bytes: int | None, attempts: int
+) -> None:
+    with TemporaryDirectory(prefix="utilitybelt_") as directory:
+        palette = os.path.join(directory, "palette.png")
+        async with keep_fresh(source, output, directory):
+            for _ in range(attempts):
+                # never scale up, only down
+                scale = f"fps={fps},scale='min({width},iw)':-2:flags=lanczos"
+                # the first pass picks the 256 colours that suit this video best
+                await run(*_trim(start, duration), "-i", source, "-vf", f"{scale},palettegen=stats_mode=diff", palette)
+                # the second maps every frame onto them, only redrawing the parts that changed
+                await run(
+                    *_trim(start, duration), "-i", source, "-i", palette,
+                    "-lavfi", f"{scale}[video];[video][1:v]paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle",
+                    "-loop", "0", output,
+                )
+                size = os.path.getsize(output)
+                if max_bytes is None or size <= max_bytes:
+                    break
+                # a gif's size is roughly proportional to its area and frame rate
+                ratio = max_bytes / size * 0.9
+                width = max(64, int(width * min(0.9, ratio ** 0.5)))
+                fps = max(5, int(fps * min(0.9, ratio ** 0.5 * 1.2)))
+            else:
+                raise FFmpegError("Couldn't make the gif small enough to upload, try a shorter clip")
+
+def _height_for(bitrate: int) -> int:
+    for limit, height in HEIGHTS:
+        if bitrate < limit:
+            return height
+    return 1080
+
+async def fit_to_size(source: str, max_bytes: int, attempts: int = 2) -> str:
+    """Re-encode a video or audio file to fit in max_bytes, returning the new file's path"""
+    info = await probe(source)
+    if not info["duration"]:
+        raise FFmpegError("Couldn't tell how long the media is")
+    has_video = any(
+        stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")
+        for stream in info["streams"]
+    )
+    # leave room for the container
+    budget = max_bytes * 8 * 0.95 / info["duration"]
+    suffix = ".mp4" if has_video else ".ogg"
+    with NamedTemporaryFile(prefix="utilitybelt_", suffix=suffix, delete=False) as result:
+        output = result.name
+    try:
+        async with keep_fresh(source, output):
+            for _ in range(attempts):
+                if has_video:
+                    audio = 96_000 if budget > 1_000_000 else 64_000
+                    video = int(budget - audio)
+                    if video < MIN_VIDEO_BITRATE:
+                        raise FFmpegError("The video is too long to fit in the upload limit")
+                    height = _height_for(video)
+                    await run(
+                        "-i", source,
+                        "-vf", f"scale=-2:'min({height},ih)'",
+                        "-c:v", "libx264", "-preset", "veryfast",
+                        "-b:v", str(video), "-maxrate", str(video), "-bufsize", str(video * 2),
+                        "-c:a", "aac", "-b:a", str(audio),
+                        "-movflags", "+faststart",
+                        output,
+                    )
+                else:
+                    # opus is still clear at low bitrates, so audio nearly always fits
+                    audio = int(min(128_000, budget))
+                    if audio < 16_000:
+                        raise FFmpegError("The audio is too long to fit in the upload limit")
+                    await run("-i", source, "-vn", "-c:a", "libopus", "-b:a", str(audio), output)
+                size = os.path.getsize(output)
+                if size <= max_bytes:
+                    return output
+                # the encoder overshot, aim lower by as much as it missed by
+                budget *= max_bytes / size * 0.95
+            raise FFmpegError("Couldn't make the media small enough to upload")
+    except BaseException:
+        os.remove(output)
+        raise
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+import time
+from os import getenv
+import aiohttp
+from .utils import keep_fresh
+from .upload import TIMEOUT, UploadError, multipart_form
+
+__all__ = ("ImgurError", "RateLimits", "limits", "configured", "upload")
+
+"""
+This module uploads to Imgur over the bot's shared aiohttp session.
+Imgur rations requests with credits, per client id and per user (IP), and
+says how many are left in the headers of every response. Those are kept in
+limits, so an upload that's sure to be refused fails straight away instead
+of costing a request, and a refused one waits for the credits to come back
+when that's soon enough.
+"""
+
+API_URL = getenv("IMGUR_API_URL", "https://api.imgur.com/3")
+# uploads cost this many credits
+UPLOAD_COST = 10
+# the most imgur takes of each, in bytes
+MAX_IMAGE_BYTES = 20 * 2**20
+MAX_VIDEO_BYTES = 200 * 2**20
+VIDEO_SUFFIXES = (".mp4", ".webm", ".mov", ".mkv", ".avi", ".m4v")
+# longer than this, it's better to tell the user to come back later
+MAX_WAIT = 30
+# how long to trust running out of client credits before asking again
+CLIENT_RECHECK = 3600
+
+class ImgurError(UploadError):
+    pass
+
+class RateLimits:
+    """The credits imgur last said were left"""
+
+    def __init__(self) -> None:
+        self.client_remaining: int | None = None
+        self.client_checked = 0.0
+        self.user_remaining: int | None = None
+        self.user_reset: float | None = None
+        self.post_remaining: int | None = None
+        self.post_reset: float | None = None
+
+    def update(self, headers) -> None:
+        def number(name: str) -> int | None:
+            value = headers.get(name)
+            return int(value) if value is not None and value.lstrip("-").isdigit() else None
+
+        if (client := number("X-RateLimit-ClientRemaining")) is not None:
+            self.client_remaining = client
+            self.client_checked = time.time()
+        if (user := number("X-RateLimit-UserRemaining")) is not None:
+            self.user_remaining = user
+        if (user_reset := number("X-RateLimit-UserReset")) is not None:
+            # a unix timestamp
+            self.user_reset = float(user_reset)
+        if (post := number("X-Post-Rate-Limit-Remaining")) is not None:
+            self.post_remaining = post
+        if (post_reset := number("X-Post-Rate-Limit-Reset")) is not None:
+            # seconds from now
+            self.post_reset = time.time() + post_reset
+
+    def wait(self) -> float | None:
+        """Seconds until an upload can be made, 0 if it can be now, None if not today"""
+        now = time.time()
+        if self.client_remaining is not None and self.client_remaining < UPLOAD_COST and now - self.client_checked < CLIENT_RECHECK:
+            # client credits come back once a day, at a time imgur doesn't say
+            return None
+        waits = [0.0]
+        if self.user_remaining is not None and self.user_remaining < UPLOAD_COST and self.user_reset:
+            waits.append(self.user_reset - now)
+        if self.post_remaining is not None and self.post_remaining < 1 and self.post_reset:
+            waits.append(self.post_reset - now)
+        return max(waits)
+
+# shared by every upload, imgur counts per client id and IP, not per connection
+limits = RateLimits()
+
+def configured() -> bool:
+    return bool(getenv("IMGUR_CLIENT_ID"))
+
+def _check_limits() -> None:
+    wait = limits.wait()
+    if wait is None:
+        raise ImgurError("Imgur's upload limit for today has been reached")
+    if wait > MAX_WAIT:
+        raise ImgurError(f"Imgur's upload limit has been reached, try again <t:{int(time.time() + wait)}:R>")
+
+async def upload(
+    session: aiohttp.ClientSession, path: str, title: str = "Uploaded via Utility Belt", progress=None, attempts: int = 4
+) -> str:
+    """Upload an image or video to Imgur and return its link"""
+    client_id = getenv("IMGUR_CLIENT_ID")
+    if not client_id:
+        raise ImgurError("Imgur API not configured")
+    video = os.path.splitext(path)[1].lower() in VIDEO_SUFFIXES
+    max_bytes = MAX_VIDEO_BYTES if video else MAX_IMAGE_BYTES
+    if (size := os.path.getsize(path)) > max_bytes:
+        raise ImgurError(f"The file is {size / 2**20:.0f}MB, Imgur only takes up to {max_bytes / 2**20:.0f}MB")
+
+    headers = {"Authorization": f"Client-ID {client_id}"}
+    async with keep_fresh(path):
+        for attempt in range(attempts):
+            _check_limits()
+            if (wait := limits.wait()) > 0:
+                await asyncio.sleep(wait)
+            delay = 2 ** attempt + random.random()
+            try:
+                form = multipart_form(
+                    path, os.path.basename(path), "video" if video else "image", {"type": "file", "title": title}, progress
+                )
+                async with session.post(f"{API_URL}/upload", data=form, headers=headers, timeout=TIMEOUT) as response:
+                    limits.update(response.headers)
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = {}
+                    data = body.get("data") if isinstance(body, dict) else None
+                    if response.ok and isinstance(data, dict) and data.get("link"):
+                        return data["link"]
+                    message = data.get("error") if isinstance(data, dict) else None
+                    if isinstance(message, dict):
+                        message = message.get("message")
+                    error = f"{response.status} {message or response.reason}"
+                    if response.status != 429 and response.status < 500:
+                        raise ImgurError(f"Failed to upload to Imgur: {error}")
+                    if response.status == 429 and limits.wait() != 0:
+                        # the headers say when the credits come back, so wait for that at the top instead
+                        delay = 0
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = str(e) or e.__class__.__name__
+            if attempt + 1 < attempts:
+                print(f"Imgur upload failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    raise ImgurError(f"Failed to upload to Imgur after {attempts} attempts: {error}")
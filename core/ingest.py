@@ -0,0 +1,271 @@
+import codecs
+import io
+import os
+import warnings
+from collections import OrderedDict
+from html.parser import HTMLParser
+from itertools import islice
+from os import getenv
+from tempfile import NamedTemporaryFile
+from time import monotonic
+from urllib.parse import urlencode, urljoin, urlsplit
+import aiofiles
+import aiohttp
+import discord
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+__all__ = (
+    "MAX_MEDIA_BYTES",
+    "MAX_VIDEO_BYTES",
+    "IngestPolicy",
+    "sniff",
+    "read_capped",
+    "download_to_file",
+    "fetch_media",
+    "resized_url",
+    "open_image",
+    "iter_frames",
+)
+
+"""
+This module fetches the media that users hand to the media commands.
+Responses are streamed in chunks and checked against their magic bytes as
+soon as the first chunk arrives, and the download is stopped once it goes
+over the byte cap, so memory per request stays bounded whatever is pasted.
+Web pages are read only up to their og:image tag, and videos are written
+to disk a chunk at a time instead of being held in memory.
+Images are then decoded no larger than the command needs, see IngestPolicy,
+and attachments are asked for already scaled down from Discord's media proxy.
+"""
+
+# the most bytes of media a command will download
+MAX_MEDIA_BYTES = int(getenv("MEDIA_MAX_BYTES", 25 * 2**20))
+# the most bytes of video a command will download to disk
+MAX_VIDEO_BYTES = int(getenv("VIDEO_MAX_BYTES", 200 * 2**20))
+# the most bytes of a web page read while looking for og:image
+MAX_PAGE_BYTES = 512 * 2**10
+CHUNK_SIZE = 64 * 2**10
+# how long a page's og:image is remembered for
+RESOLVE_TTL = 600
+RESOLVE_CACHE_SIZE = 1024
+# discord's media proxy scales images given width and height query parameters
+MEDIA_PROXY = getenv("MEDIA_PROXY_BASE", "https://media.discordapp.net").rstrip("/")
+
+_resolved: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+class IngestPolicy:
+    """How big an input image a command works with"""
+
+    def __init__(
+        self,
+        max_side: int = 1024,
+        max_pixels: int = int(getenv("MEDIA_MAX_PIXELS", 50_000_000)),
+        max_frames: int = 200,
+    ) -> None:
+        # the longest side of the working resolution, bigger images are scaled down to it
+        self.max_side = max_side
+        # the most pixels that may be decoded before the image is refused as a decompression bomb
+        self.max_pixels = max_pixels
+        # animations are cut off after this many frames
+        self.max_frames = max_frames
+
+    def __repr__(self) -> str:
+        # part of the transform cache keys, so it has to be stable between runs
+        return f"IngestPolicy({self.max_side}, {self.max_pixels}, {self.max_frames})"
+
+DEFAULT_POLICY = IngestPolicy()
+
+def sniff(head: bytes) -> str | None:
+    """Identify the format of some data from its first bytes"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head.startswith(b"BM"):
+        return "bmp"
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n")[:1] == b"<":
+        return "html"
+    return None
+
+def _too_big(limit: int) -> discord.errors.ApplicationCommandError:
+    return discord.errors.ApplicationCommandError(
+        f"Media is too big, the limit is {limit / 2**20:.0f}MB"
+    )
+
+async def read_capped(
+    response: aiohttp.ClientResponse, limit: int = MAX_MEDIA_BYTES, head: bytes = b""
+) -> bytes:
+    """Read a response in chunks, giving up as soon as it goes over `limit` bytes"""
+    if response.content_length is not None and response.content_length > limit:
+        raise _too_big(limit)
+    # head is anything already read from the response
+    data = bytearray(head)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        data += chunk
+        if len(data) > limit:
+            raise _too_big(limit)
+    return bytes(data)
+
+async def download_to_file(
+    session: aiohttp.ClientSession, url: str, suffix: str = "", limit: int = MAX_VIDEO_BYTES
+) -> str:
+    """Stream a download to a temporary file a chunk at a time, returning the file's path"""
+    async with session.get(url) as response:
+        if not response.ok:
+            raise discord.errors.ApplicationCommandError(
+                f"Failed to download media: {response.status} {response.reason}"
+            )
+        # refuse before reading anything when the size is known
+        if response.content_length is not None and response.content_length > limit:
+            raise _too_big(limit)
+        with NamedTemporaryFile(prefix="utilitybelt_", suffix=suffix, delete=False) as temp_file:
+            path = temp_file.name
+        try:
+            size = 0
+            async with aiofiles.open(path, "wb") as file:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    # the header can be missing or wrong
+                    if size > limit:
+                        raise _too_big(limit)
+                    await file.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+    return path
+
+class _OpenGraphParser(HTMLParser):
+    # stops looking once it finds og:image or reaches the end of <head>
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.image: str | None = None
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if self.done:
+            return
+        if tag == "meta":
+            attrs = dict(attrs)
+            if attrs.get("property") == "og:image" and attrs.get("content"):
+                self.image = attrs["content"]
+                self.done = True
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "head":
+            self.done = True
+
+async def _find_og_image(response: aiohttp.ClientResponse, head: bytes) -> str | None:
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = _OpenGraphParser()
+    parser.feed(decoder.decode(head))
+    read = len(head)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        if parser.done or read > MAX_PAGE_BYTES:
+            break
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+    return parser.image and urljoin(str(response.url), parser.image)
+
+def _remember(url: str, media_url: str) -> None:
+    _resolved[url] = (media_url, monotonic() + RESOLVE_TTL)
+    _resolved.move_to_end(url)
+    while len(_resolved) > RESOLVE_CACHE_SIZE:
+        _resolved.popitem(last=False)
+
+def _recall(url: str) -> str | None:
+    if (entry := _resolved.get(url)) is None:
+        return None
+    media_url, expires = entry
+    if monotonic() > expires:
+        del _resolved[url]
+        return None
+    return media_url
+
+async def fetch_media(
+    session: aiohttp.ClientSession, url: str, limit: int = MAX_MEDIA_BYTES, follow_page: bool = True
+) -> bytes:
+    """Download the image at a URL, or the og:image of the web page at it"""
+    if media_url := _recall(url):
+        return await fetch_media(session, media_url, limit, follow_page=False)
+    async with session.get(url) as response:
+        if not response.ok:
+            raise discord.errors.ApplicationCommandError(
+                f"Failed to fetch media: {response.status} {response.reason}"
+            )
+        # read just enough to tell what it is
+        head = b""
+        while len(head) < 16 and (chunk := await response.content.read(16 - len(head))):
+            head += chunk
+        kind = sniff(head)
+        if kind == "html" and follow_page:
+            media_url = await _find_og_image(response, head)
+            if media_url is None:
+                raise discord.errors.ApplicationCommandError("No image found on that page")
+        elif kind == "html":
+            raise discord.errors.ApplicationCommandError("Invalid image")
+        else:
+            # formats sniff doesn't know, like tiff and ico, are left for pillow to decide
+            return await read_capped(response, limit, head)
+
+    _remember(url, media_url)
+    return await fetch_media(session, media_url, limit, follow_page=False)
+
+def resized_url(attachment: discord.Attachment, policy: IngestPolicy = DEFAULT_POLICY) -> str | None:
+    """The media proxy URL of an attachment scaled to the policy's working resolution, if it's worth it"""
+    if not attachment.width or not attachment.height:
+        return None
+    # the proxy only returns the first frame of an animation
+    if attachment.content_type not in ("image/png", "image/jpeg"):
+        return None
+    scale = policy.max_side / max(attachment.width, attachment.height)
+    if scale >= 1:
+        return None
+    # keep the signed query parameters, the proxy needs them to serve the file
+    parts = urlsplit(attachment.proxy_url or attachment.url)
+    query = "&".join(
+        part for part in (parts.query.rstrip("&"), urlencode({
+            "width": max(1, round(attachment.width * scale)),
+            "height": max(1, round(attachment.height * scale)),
+        })) if part
+    )
+    return f"{MEDIA_PROXY}{parts.path}?{query}"
+
+def open_image(data: bytes, policy: IngestPolicy = DEFAULT_POLICY) -> Image.Image:
+    """Decode an image at no more than the policy's working resolution, this blocks"""
+    try:
+        with warnings.catch_warnings():
+            # the pixel budget below replaces pillow's own warning
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            image = Image.open(io.BytesIO(data))
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise discord.errors.ApplicationCommandError("Invalid image")
+    if image.format == "JPEG":
+        # let the decoder skip detail with DCT scaling, at least the size asked for is kept
+        image.draft(image.mode, (policy.max_side, policy.max_side))
+    # only the header has been read so far, so this is checked before any pixels are decoded
+    if image.width * image.height > policy.max_pixels:
+        raise discord.errors.ApplicationCommandError(
+            f"Image is too large ({image.width}x{image.height})"
+        )
+    if getattr(image, "is_animated", False):
+        # frames are scaled one at a time by iter_frames
+        return image
+    # thumbnail uses reduce() for most of the shrinking, which is far cheaper than resampling
+    image.thumbnail((policy.max_side, policy.max_side), reducing_gap=2.0)
+    return image
+
+def iter_frames(image: Image.Image, policy: IngestPolicy = DEFAULT_POLICY):
+    """Yield the frames of an animation scaled to the policy's working resolution"""
+    for frame in islice(ImageSequence.Iterator(image), policy.max_frames):
+        frame = frame.copy()
+        frame.thumbnail((policy.max_side, policy.max_side), reducing_gap=2.0)
+        yield frame
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from time import perf_counter
+from aiohttp import web
+
+__all__ = ("Histogram", "Metrics", "serve_metrics")
+
+"""
+This module records how long commands take.
+Timings are kept per command and stage in log-linear histograms, which
+give percentiles with a bounded relative error in constant memory.
+"""
+
+class Histogram:
+    """Log-linear histogram of durations in the style of HdrHistogram"""
+
+    # every power of two is split into this many linear sub-buckets, so a
+    # recorded value is off by at most 1/32 (~3%)
+    sub_buckets = 32
+    # values are counted in whole microseconds
+    unit = 1e-6
+
+    def __init__(self) -> None:
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, seconds: float) -> int:
+        units = max(0, int(seconds / self.unit))
+        if units < self.sub_buckets:
+            return units
+        shift = units.bit_length() - self.sub_buckets.bit_length()
+        return self.sub_buckets * (shift + 1) + (units >> shift) - self.sub_buckets
+
+    def _upper(self, index: int) -> float:
+        # the highest value (in seconds) that lands in a bucket
+        if index < self.sub_buckets:
+            return (index + 1) * self.unit
+        shift, top = divmod(index, self.sub_buckets)
+        return ((top + self.sub_buckets + 1) << (shift - 1)) * self.unit
+
+    def record(self, seconds: float) -> None:
+        index = self._index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    def cumulative(self, bounds: tuple[float, ...]) -> list[int]:
+        # the number of values at or below each bound, for prometheus buckets
+        ordered = sorted(self.counts.items())
+        result = []
+        for bound in bounds:
+            result.append(sum(count for index, count in ordered if self._upper(index) <= bound))
+        return result
+
+class Metrics:
+    """Timings for every command, split into named stages"""
+
+    # the bucket bounds used for the prometheus dump
+    prometheus_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self) -> None:
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+
+    def record(self, command: str, stage: str, seconds: float) -> None:
+        if (command, stage) not in self.histograms:
+            self.histograms[command, stage] = Histogram()
+        self.histograms[command, stage].record(seconds)
+
+    @contextmanager
+    def timer(self, command: str, stage: str):
+        """Time the body of a with block as a stage of a command"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(command, stage, perf_counter() - start)
+
+    def summary(self, command: str | None = None) -> list[dict]:
+        return [
+            {
+                "command": name,
+                "stage": stage,
+                "count": histogram.count,
+                "p50": histogram.percentile(50),
+                "p90": histogram.percentile(90),
+                "p99": histogram.percentile(99),
+                "max": histogram.max,
+            }
+            for (name, stage), histogram in sorted(self.histograms.items())
+            if command is None or name == command
+        ]
+
+    def prometheus(self) -> str:
+        """Dump every histogram in the prometheus text format"""
+        name = "utilitybelt_command_seconds"
+        lines = [
+            f"# HELP {name} Time taken by each stage of a command.",
+            f"# TYPE {name} histogram",
+        ]
+        for (command, stage), histogram in sorted(self.histograms.items()):
+            labels = f'command="{command}",stage="{stage}"'
+            for bound, count in zip(self.prometheus_buckets, histogram.cumulative(self.prometheus_buckets)):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        quantiles = "utilitybelt_command_quantile_seconds"
+        lines += [
+            f"# HELP {quantiles} Percentiles of the time taken by each stage of a command.",
+            f"# TYPE {quantiles} gauge",
+        ]
+        for (command, stage), histogram in sorted(self.histograms.items()):
+            for quantile in (0.5, 0.9, 0.99):
+                lines.append(
+                    f'{quantiles}{{command="{command}",stage="{stage}",quantile="{quantile}"}} '
+                    f"{histogram.percentile(quantile * 100)}"
+                )
+        return "\n".join(lines) + "\n"
+
+async def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    """Serve the prometheus dump on http://host:port/metrics"""
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,164 @@
+import json
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+from .models import StatsModel
+
+__all__ = ("migrate", "get_version", "MIGRATIONS")
+
+"""
+This module contains the versioned migrations for the database.
+The schema version is stored in SQLite's user_version pragma, and each
+migration runs once, in order, when the bot starts.
+"""
+
+async def get_version(conn: BaseDBAsyncClient) -> int:
+    # method to get the schema version of the database
+    rows = await conn.execute_query_dict("PRAGMA user_version")
+    return rows[0]["user_version"]
+
+async def set_version(conn: BaseDBAsyncClient, version: int) -> None:
+    # pragmas can't take parameters, so make sure this is a plain integer
+    await conn.execute_script(f"PRAGMA user_version = {int(version)}")
+
+async def has_index(
+    conn: BaseDBAsyncClient, table: str, column: str, unique: bool = False
+) -> bool:
+    # check if a single column index already exists, including the ones
+    # sqlite creates automatically for UNIQUE constraints
+    for index in await conn.execute_query_dict(f'PRAGMA index_list("{table}")'):
+        if unique and not index["unique"]:
+            continue
+        columns = await conn.execute_query_dict(f'PRAGMA index_info("{index["name"]}")')
+        if [col["name"] for col in columns] == [column]:
+            return True
+    return False
+
+async def baseline_schema(conn: BaseDBAsyncClient) -> None:
+    # create any missing tables, this is what generate_schemas used to do on every start
+    await generate_schema_for_client(conn, safe=True)
+
+async def user_indexes(conn: BaseDBAsyncClient) -> None:
+    # merge duplicate users into the oldest row so user_id can be made unique
+    async with in_transaction() as transaction:
+        duplicates = await transaction.execute_query_dict(
+            'SELECT "user_id" FROM "user" GROUP BY "user_id" HAVING COUNT(*) > 1'
+        )
+        for duplicate in duplicates:
+            rows = await transaction.execute_query_dict(
+                'SELECT * FROM "user" WHERE "user_id" = ? ORDER BY "id"',
+                [duplicate["user_id"]],
+            )
+            keep, *extra = rows
+            notes = {}
+            for row in rows:
+                try:
+                    notes.update(json.loads(row["notes"] or "{}"))
+                except (TypeError, ValueError):
+                    pass
+            await transaction.execute_query(
+                'UPDATE "user" SET "user_name" = ?, "user_discriminator" = ?, "notes" = ?, '
+                '"baned" = ?, "commands_used" = ? WHERE "id" = ?',
+                [
+                    rows[-1]["user_name"],
+                    rows[-1]["user_discriminator"],
+                    json.dumps(notes),
+                    any(row["baned"] for row in rows),
+                    sum(row["commands_used"] or 0 for row in rows),
+                    keep["id"],
+                ],
+            )
+            await transaction.execute_query(
+                f'DELETE FROM "user" WHERE "id" IN ({", ".join("?" * len(extra))})',
+                [row["id"] for row in extra],
+            )
+        if duplicates:
+            print(f"Merged {len(duplicates)} duplicate user{'s' if len(duplicates) != 1 else ''}")
+
+    if not await has_index(conn, "user", "user_id", unique=True):
+        await conn.execute_script(
+            'CREATE UNIQUE INDEX IF NOT EXISTS "uid_user_user_id" ON "user" ("user_id")'
+        )
+    if not await has_index(conn, "user", "commands_used"):
+        await conn.execute_script(
+            'CREATE INDEX IF NOT EXISTS "idx_user_commands_used" ON "user" ("commands_used")'
+        )
+
+async def note_table(conn: BaseDBAsyncClient) -> None:
+    # move the notes out of the user's json blob into their own table
+    await generate_schema_for_client(conn, safe=True)
+    async with in_transaction() as transaction:
+        await transaction.execute_query(
+            'INSERT INTO "note" ("user_id", "title", "content", "created_at", "updated_at") '
+            'SELECT "user"."user_id", substr("notes"."key", 1, 100), CAST("notes"."value" AS TEXT), '
+            "datetime('now'), datetime('now') "
+            'FROM "user", json_each(CASE WHEN json_valid("user"."notes") '
+            'THEN "user"."notes" ELSE \'{}\' END) AS "notes" '
+            # arrays have integer keys, only objects map titles to content
+            'WHERE typeof("notes"."key") = \'text\' '
+            'ON CONFLICT ("user_id", "title") DO NOTHING'
+        )
+
+    # external content fts5 index over the note table, kept in sync with triggers
+    await conn.execute_script(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS "note_fts" USING fts5(
+            "title", "content", content="note", content_rowid="id"
+        );
+        INSERT INTO "note_fts" ("note_fts") VALUES ('rebuild');
+        CREATE TRIGGER IF NOT EXISTS "note_fts_insert" AFTER INSERT ON "note" BEGIN
+            INSERT INTO "note_fts" ("rowid", "title", "content")
+            VALUES (new."id", new."title", new."content");
+        END;
+        CREATE TRIGGER IF NOT EXISTS "note_fts_delete" AFTER DELETE ON "note" BEGIN
+            INSERT INTO "note_fts" ("note_fts", "rowid", "title", "content")
+            VALUES ('delete', old."id", old."title", old."content");
+        END;
+        CREATE TRIGGER IF NOT EXISTS "note_fts_update" AFTER UPDATE ON "note" BEGIN
+            INSERT INTO "note_fts" ("note_fts", "rowid", "title", "content")
+            VALUES ('delete', old."id", old."title", old."content");
+            INSERT INTO "note_fts" ("rowid", "title", "content")
+            VALUES (new."id", new."title", new."content");
+        END;
+        """
+    )
+
+async def stats_rollups(conn: BaseDBAsyncClient) -> None:
+    # index the stats by time and backfill the daily and weekly rollups from the hourly rows
+    await generate_schema_for_client(conn, safe=True)
+    buckets = {
+        "stats_daily": '"date"',
+        "stats_weekly": 'date("date", \'weekday 0\', \'-6 days\')',
+    }
+    async with in_transaction() as transaction:
+        for table, bucket in buckets.items():
+            for metric in StatsModel.metrics:
+                await transaction.execute_query(
+                    f'INSERT INTO "{table}" ("bucket", "metric", "samples", "total", "minimum", "maximum") '
+                    f'SELECT {bucket}, ?, COUNT("{metric}"), SUM("{metric}"), MIN("{metric}"), MAX("{metric}") '
+                    f'FROM "stats" WHERE "{metric}" IS NOT NULL GROUP BY {bucket} '
+                    'ON CONFLICT ("bucket", "metric") DO NOTHING',
+                    [metric],
+                )
+
+# (version, description, migration), append new migrations to the end
+MIGRATIONS = (
+    (1, "baseline schema", baseline_schema),
+    (2, "unique user_id and commands_used indexes", user_indexes),
+    (3, "note table with full text search", note_table),
+    (4, "stats index and daily/weekly rollups", stats_rollups),
+)
+
+async def migrate(connection_name: str = "default") -> int:
+    """Apply any pending migrations and return the new schema version"""
+    conn = connections.get(connection_name)
+    version = await get_version(conn)
+    for target, description, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        print(f"Applying migration {target}: {description}")
+        await migration(conn)
+        await set_version(conn, target)
+        version = target
+    return version
@@ -1,7 +1,19 @@
-from tortoise import fields
+import datetime
+import random
+from tortoise import fields, timezone
+from tortoise.expressions import Q
+from tortoise.functions import Count, Sum
 from tortoise.models import Model
+from tortoise.transactions import in_transaction
 
-__all__ = ("BotModel", "StatsModel", "UserModel")
+__all__ = (
+    "BotModel",
+    "DailyStatsModel",
+    "NoteModel",
+    "StatsModel",
+    "UserModel",
+    "WeeklyStatsModel",
+)
 
 """
 This module contains the models for the database.
@@ -37,6 +49,15 @@ class StatsModel(Model):
     guild_member_total = fields.IntField()
     active_users = fields.IntField()
 
+    # the columns that are rolled up into the daily and weekly tables
+    metrics = (
+        "user_count",
+        "guild_count",
+        "total_command_count",
+        "guild_member_total",
+        "active_users",
+    )
+
     @classmethod
     async def get_stats(cls) -> dict:
         # method to get the bot's stats
@@ -54,20 +75,147 @@ class StatsModel(Model):
                 for stats in await cls.all()
             ]
         }
+
+    @classmethod
+    async def record(cls, date: datetime.date, time: datetime.time, **values: int) -> "StatsModel":
+        # method to log a sample and add it to the daily and weekly rollups
+        async with in_transaction():
+            stats = await cls.create(date=date, time=time, **values)
+            await DailyStatsModel.add_sample(date, values)
+            await WeeklyStatsModel.add_sample(date, values)
+        return stats
+
+    @classmethod
+    async def query(
+        cls,
+        start: datetime.date | None = None,
+        end: datetime.date | None = None,
+        bucket: str = "hour",
+        metrics: tuple = metrics,
+    ) -> list:
+        """
+        Get the stats between two dates (inclusive), grouped into hour, day or week buckets.
+        Each bucket has the min, max and avg of every metric, days and weeks are read
+        from the rollup tables instead of the hourly rows.
+        """
+        if bucket in ROLLUPS:
+            return await ROLLUPS[bucket].query(start, end, metrics)
+        if bucket != "hour":
+            raise ValueError(f"Unknown bucket {bucket!r}")
+
+        rows = cls.all()
+        if start is not None:
+            rows = rows.filter(date__gte=start)
+        if end is not None:
+            rows = rows.filter(date__lte=end)
+        return [
+            {
+                # log_data writes the date and time in utc
+                "bucket": datetime.datetime.combine(row["date"], row["time"], datetime.timezone.utc),
+                **{
+                    metric: {"min": row[metric], "max": row[metric], "avg": row[metric]}
+                    for metric in metrics
+                },
+            }
+            for row in await rows.order_by("date", "time").values("date", "time", *metrics)
+        ]
+
+    @classmethod
+    async def latest_id(cls) -> int | None:
+        # method to get the id of the last row logged, which changes whenever the stats do
+        return await cls.all().order_by("-id").first().values_list("id", flat=True)
     
     class Meta:
         # metadata for the model
         table = "stats"
+        indexes = (("date", "time"),)
+
+class StatsRollupModel(Model):
+    # base class for the rolled up stats, one row per metric per bucket.
+    # subclasses define bucket_for(date), the bucket a date falls in
+    id = fields.IntField(pk=True)
+    bucket = fields.DateField()
+    metric = fields.CharField(max_length=32)
+    samples = fields.IntField(default=0)
+    total = fields.BigIntField(default=0)
+    minimum = fields.BigIntField()
+    maximum = fields.BigIntField()
+
+    @classmethod
+    async def add_sample(cls, date: datetime.date, values: dict) -> None:
+        # method to fold one sample of every metric into its bucket
+        await cls._meta.db.execute_many(
+            f'INSERT INTO "{cls._meta.db_table}" '
+            '("bucket", "metric", "samples", "total", "minimum", "maximum") '
+            "VALUES (?, ?, 1, ?, ?, ?) "
+            'ON CONFLICT ("bucket", "metric") DO UPDATE SET '
+            '"samples" = "samples" + 1, '
+            '"total" = "total" + excluded."total", '
+            '"minimum" = MIN("minimum", excluded."minimum"), '
+            '"maximum" = MAX("maximum", excluded."maximum")',
+            [
+                [cls.bucket_for(date).isoformat(), metric, value, value, value]
+                for metric, value in values.items()
+            ],
+        )
+
+    @classmethod
+    async def query(
+        cls, start: datetime.date | None, end: datetime.date | None, metrics: tuple
+    ) -> list:
+        # method to get the buckets between two dates, in the same shape as StatsModel.query
+        rows = cls.filter(metric__in=metrics)
+        if start is not None:
+            rows = rows.filter(bucket__gte=cls.bucket_for(start))
+        if end is not None:
+            rows = rows.filter(bucket__lte=end)
+        buckets = {}
+        for row in await rows.order_by("bucket").values(
+            "bucket", "metric", "samples", "total", "minimum", "maximum"
+        ):
+            buckets.setdefault(row["bucket"], {"bucket": row["bucket"]})[row["metric"]] = {
+                "min": row["minimum"],
+                "max": row["maximum"],
+                "avg": row["total"] / row["samples"],
+            }
+        return list(buckets.values())
+
+    class Meta:
+        abstract = True
+
+class DailyStatsModel(StatsRollupModel):
+    # class to store the stats rolled up per day
+    @staticmethod
+    def bucket_for(date: datetime.date) -> datetime.date:
+        return date
+
+    class Meta:
+        # metadata for the model
+        table = "stats_daily"
+        unique_together = (("bucket", "metric"),)
+
+class WeeklyStatsModel(StatsRollupModel):
+    # class to store the stats rolled up per week, starting on monday
+    @staticmethod
+    def bucket_for(date: datetime.date) -> datetime.date:
+        return date - datetime.timedelta(days=date.weekday())
+
+    class Meta:
+        # metadata for the model
+        table = "stats_weekly"
+        unique_together = (("bucket", "metric"),)
+
+ROLLUPS = {"day": DailyStatsModel, "week": WeeklyStatsModel}
 
 class UserModel(Model):
     # class to store the user's data
     id = fields.IntField(pk=True)
-    user_id = fields.BigIntField()
+    user_id = fields.BigIntField(unique=True)
     user_name = fields.CharField(max_length=70)
     user_discriminator = fields.CharField(max_length=4)
-    notes = fields.JSONField()
+    notes = fields.JSONField()  # legacy, notes are stored in NoteModel since migration 3
     baned = fields.BooleanField(default=False)
-    commands_used = fields.IntField(default=0)
+    commands_used = fields.IntField(default=0, index=True)
 
     @classmethod
     async def get_user_data(cls, user_id: int) -> dict:
@@ -83,6 +231,17 @@ class UserModel(Model):
             }
         }
     
+    @classmethod
+    async def record_command(cls, user_id: int, user_name: str, user_discriminator: str) -> None:
+        # method to count a command in one statement, so a user's first two commands can't both insert
+        await cls._meta.db.execute_query(
+            f'INSERT INTO "{cls._meta.db_table}" '
+            '("user_id", "user_name", "user_discriminator", "notes", "baned", "commands_used") '
+            "VALUES (?, ?, ?, '{}', 0, 1) "
+            'ON CONFLICT ("user_id") DO UPDATE SET "commands_used" = "commands_used" + 1',
+            [user_id, user_name, user_discriminator],
+        )
+
     @classmethod
     async def get_top_users(cls) -> list:
         # method to get the top users
@@ -93,9 +252,112 @@ class UserModel(Model):
             }
             for user in await cls.all().order_by("-commands_used").limit(25)
         ]
+
+    @classmethod
+    async def get_command_totals(cls) -> dict:
+        # method to get the command usage totals, aggregated in the database
+        totals = await cls.all().annotate(
+            user_count=Count("id"),
+            active_users=Count("id", _filter=Q(commands_used__gt=0)),
+            total_command_count=Sum("commands_used"),
+        ).first().values("user_count", "active_users", "total_command_count")
+        return {
+            key: (totals and totals[key]) or 0
+            for key in ("user_count", "active_users", "total_command_count")
+        }
+
+    @classmethod
+    async def get_random_user_ids(cls, count: int = 5, exclude: tuple[int, ...] = (), rounds: int = 4) -> list[int]:
+        # method to sample distinct users uniformly by probing random rowids, which never scans the table
+        rows = await cls._meta.db.execute_query_dict(f'SELECT MAX("id") AS "top" FROM "{cls._meta.db_table}"')
+        top = rows[0]["top"] if rows else None
+        if not top:
+            return []
+        user_ids: list[int] = []
+        seen = set(exclude)
+        for attempt in range(rounds):
+            # deleted rows leave gaps in the ids, so probe more than are needed, and more each round
+            probes = random.sample(range(1, top + 1), min(top, (count - len(user_ids)) * 2 ** (attempt + 1)))
+            rows = await cls._meta.db.execute_query_dict(
+                f'SELECT "user_id" FROM "{cls._meta.db_table}" WHERE "id" IN ({", ".join("?" * len(probes))})',
+                probes,
+            )
+            found = [row["user_id"] for row in rows if row["user_id"] not in seen]
+            # IN gives them back in id order
+            random.shuffle(found)
+            for user_id in found[:count - len(user_ids)]:
+                seen.add(user_id)
+                user_ids.append(user_id)
+            if len(user_ids) >= count:
+                break
+        return user_ids
     
     class Meta:
         # metadata for the model
         table = "user"
 
-    
\ No newline at end of file
+class NoteModel(Model):
+    # class to store the user's notes, one row per note
+    id = fields.IntField(pk=True)
+    user_id = fields.BigIntField()
+    title = fields.CharField(max_length=100)
+    content = fields.TextField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    @classmethod
+    async def write(cls, user_id: int, title: str, content: str) -> None:
+        # method to create or overwrite a single note in one statement
+        now = cls._meta.fields_map["updated_at"].to_db_value(timezone.now(), cls)
+        await cls._meta.db.execute_query(
+            'INSERT INTO "note" ("user_id", "title", "content", "created_at", "updated_at") '
+            "VALUES (?, ?, ?, ?, ?) "
+            'ON CONFLICT ("user_id", "title") DO UPDATE SET '
+            '"content" = excluded."content", "updated_at" = excluded."updated_at"',
+            [user_id, title, content, now, now],
+        )
+
+    @classmethod
+    async def remove(cls, user_id: int, title: str) -> bool:
+        # method to delete a note, returns whether it existed
+        return bool(await cls.filter(user_id=user_id, title=title).delete())
+
+    @classmethod
+    async def get_page(
+        cls, user_id: int, after: str | None = None, before: str | None = None, limit: int = 25
+    ) -> list:
+        # method to get a page of (id, title) pairs ordered by title,
+        # keyed on the last title of the previous page or the first title of the next
+        query = cls.filter(user_id=user_id)
+        if before is not None:
+            page = await query.filter(title__lt=before).order_by("-title").limit(limit).values_list("id", "title")
+            return page[::-1]
+        if after is not None:
+            query = query.filter(title__gt=after)
+        return await query.order_by("title").limit(limit).values_list("id", "title")
+
+    @classmethod
+    async def get_titles(cls, user_id: int) -> list:
+        # method to get all of the user's note titles in order
+        return await cls.filter(user_id=user_id).order_by("title").values_list("title", flat=True)
+
+    @classmethod
+    async def search(cls, user_id: int, query: str, limit: int = 10) -> list:
+        # method to search the user's notes with the full text index, best matches first
+        # quote every term so user input can't be parsed as fts5 query syntax
+        terms = " ".join(f'"{term.replace(chr(34), chr(34) * 2)}"' for term in query.split())
+        if not terms:
+            return []
+        return await cls._meta.db.execute_query_dict(
+            'SELECT "note"."id", "note"."title", '
+            "snippet(\"note_fts\", 1, '**', '**', '...', 24) AS \"snippet\" "
+            'FROM "note_fts" JOIN "note" ON "note"."id" = "note_fts"."rowid" '
+            'WHERE "note_fts" MATCH ? AND "note"."user_id" = ? '
+            'ORDER BY "note_fts"."rank" LIMIT ?',
+            [terms, user_id, limit],
+        )
+
+    class Meta:
+        # metadata for the model
+        table = "note"
+        unique_together = (("user_id", "title"),)
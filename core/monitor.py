@@ -0,0 +1,142 @@
+import asyncio
+import concurrent.futures
+import io
+import sys
+import threading
+import traceback
+from collections import deque
+from time import perf_counter, sleep
+from weakref import WeakKeyDictionary
+import discord
+from discord.utils import utcnow
+from .metrics import Histogram
+
+__all__ = ("LoopMonitor",)
+
+"""
+This module watches the event loop for stalls.
+A task on the loop ticks a heartbeat, and a watchdog thread checks it. When
+the heartbeat is late, the watchdog grabs the loop thread's stack while it
+is still stuck, which points straight at the blocking call, and looks up the
+command whose task is running.
+"""
+
+class LoopMonitor:
+    """Measure event loop lag and record every stall over a threshold"""
+
+    def __init__(
+        self,
+        bot,
+        threshold: float = 0.25,
+        interval: float = 0.1,
+        history: int = 50,
+        alert_cooldown: float = 300,
+    ) -> None:
+        self.bot = bot
+        self.threshold = threshold
+        self.interval = interval
+        self.alert_cooldown = alert_cooldown
+        self.lag = Histogram()
+        self.stalls: deque[dict] = deque(maxlen=history)
+        # the context of the command each task is running
+        self.contexts: WeakKeyDictionary[asyncio.Task, object] = WeakKeyDictionary()
+        self.heartbeat = perf_counter()
+        self.last_alert = 0.0
+        self._stopped = threading.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = perf_counter()
+        self._task = self.loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    def track(self, ctx) -> None:
+        """Remember which command the current task is running"""
+        if task := asyncio.current_task():
+            self.contexts[task] = ctx
+
+    async def _beat(self) -> None:
+        while True:
+            expected = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = perf_counter()
+            self.lag.record(max(0.0, now - expected))
+            self.heartbeat = now
+
+    def _running_command(self) -> str | None:
+        # this runs on the watchdog thread, so never let it take the thread down
+        try:
+            task = asyncio.current_task(self.loop)
+            ctx = task and self.contexts.get(task)
+            if ctx is None:
+                return None
+            return f"/{ctx.command_name} by {ctx.author} ({ctx.author.id})"
+        except Exception:
+            return None
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval / 2):
+            beat = self.heartbeat
+            if perf_counter() - beat < self.interval + self.threshold:
+                continue
+
+            # the loop is stuck, take the evidence before it moves on
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "Stack unavailable"
+            command = self._running_command()
+            del frame
+
+            # wait for the loop to recover so the whole stall is measured
+            while self.heartbeat == beat and not self._stopped.is_set():
+                sleep(self.interval / 2)
+            stall = {
+                "at": utcnow(),
+                "duration": self.heartbeat - beat - self.interval,
+                "command": command,
+                "stack": stack,
+            }
+            self.stalls.append(stall)
+            if not self._stopped.is_set():
+                future = asyncio.run_coroutine_threadsafe(self.alert(stall), self.loop)
+                future.add_done_callback(self._alert_done)
+
+    def _alert_done(self, future: concurrent.futures.Future) -> None:
+        # nothing awaits the alert, so a failed send would otherwise vanish
+        if future.cancelled():
+            return
+        if error := future.exception():
+            print(f"Stall alert failed: {error.__class__.__name__}: {error}")
+
+    async def alert(self, stall: dict) -> None:
+        """Post a stall to the errors webhook, at most once per cooldown"""
+        webhook = getattr(self.bot, "errors_webhook", None)
+        now = perf_counter()
+        if webhook is None or now - self.last_alert < self.alert_cooldown:
+            return
+        self.last_alert = now
+        await webhook.send(
+            f"Event loop stalled for {stall['duration'] * 1000:.0f}ms"
+            f" | Command: `{stall['command'] or 'none'}`",
+            file=discord.File(io.BytesIO(stall["stack"].encode()), filename="stall.txt"),
+        )
+
+    def report(self) -> str:
+        lines = [
+            f"Loop lag p50 {self.lag.percentile(50) * 1000:.1f}ms"
+            f" | p99 {self.lag.percentile(99) * 1000:.1f}ms"
+            f" | max {self.lag.max * 1000:.1f}ms"
+            f" | stalls over {self.threshold * 1000:.0f}ms: {len(self.stalls)}",
+        ]
+        for stall in reversed(self.stalls):
+            lines.append(
+                f"{stall['at']:%Y-%m-%d %H:%M:%S} {stall['duration'] * 1000:>8.0f}ms"
+                f"  {stall['command'] or 'no command'}"
+            )
+        return "\n".join(lines)
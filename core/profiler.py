@@ -0,0 +1,128 @@
+import html
+import os
+import sys
+import threading
+import tracemalloc
+import zlib
+from collections import Counter
+from time import perf_counter, sleep
+
+__all__ = (
+    "sample_stacks",
+    "collapse",
+    "flame_graph",
+    "take_snapshot",
+    "compare_snapshots",
+)
+
+"""
+This module profiles the running bot for the owner commands.
+The stack sampler runs in its own thread and reads every other thread's
+stack with sys._current_frames(), so the bot doesn't have to stop or be
+started under a profiler.
+"""
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample_stacks(duration: float, interval: float = 0.005) -> Counter:
+    """Sample every thread's stack for `duration` seconds, counting each distinct stack"""
+    current = threading.get_ident()
+    stacks = Counter()
+    end = perf_counter() + duration
+    while perf_counter() < end:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            parts = []
+            while frame is not None:
+                parts.append(_frame_name(frame))
+                frame = frame.f_back
+            parts.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(parts))] += 1
+        sleep(interval)
+    return stacks
+
+def collapse(stacks: Counter) -> str:
+    """Format stacks in the collapsed format used by flamegraph.pl and speedscope"""
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+def _colour(name: str) -> str:
+    # stable warm colours so the same function looks the same across graphs
+    value = zlib.crc32(name.encode())
+    return f"rgb({205 + value % 50},{(value >> 8) % 180},{(value >> 16) % 55})"
+
+def flame_graph(stacks: Counter, title: str = "Flame Graph", width: int = 1200) -> str:
+    """Render the sampled stacks to a flame graph SVG"""
+    tree = {"children": {}, "count": 0}
+    for stack, count in stacks.items():
+        node = tree
+        node["count"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "count": 0})
+            node["count"] += count
+
+    total = tree["count"] or 1
+    row_height = 16
+    rects = []
+    depth_reached = 0
+
+    def draw(node: dict, x: float, depth: int) -> None:
+        nonlocal depth_reached
+        for name, child in sorted(node["children"].items()):
+            child_width = child["count"] / total * width
+            if child_width >= 0.5:
+                depth_reached = max(depth_reached, depth)
+                rects.append((x, depth, child_width, name, child["count"]))
+                draw(child, x, depth + 1)
+            x += child_width
+
+    draw(tree, 0.0, 0)
+    height = (depth_reached + 1) * row_height + 40
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="15">{html.escape(title)}</text>',
+    ]
+    for x, depth, rect_width, name, count in rects:
+        # the root is at the bottom, like flamegraph.pl
+        y = height - (depth + 1) * row_height
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{row_height - 1}" '
+            f'fill="{_colour(name)}" rx="2"/>'
+        )
+        # roughly 7 pixels per character at this font size
+        if (characters := int(rect_width / 7)) > 3:
+            text = name if len(name) <= characters else name[: characters - 2] + ".."
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + 11}">{html.escape(text)}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """Take a tracemalloc snapshot without the allocations made by tracemalloc itself"""
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
+
+def compare_snapshots(
+    old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, limit: int = 15
+) -> str:
+    """List the lines whose allocations grew the most between two snapshots"""
+    lines = []
+    for stat in new.compare_to(old, "lineno")[:limit]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+7} blocks"
+            f"  {os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return "\n".join(lines) or "No allocations changed."
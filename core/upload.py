@@ -0,0 +1,107 @@
+import asyncio
+import os
+import random
+from os import getenv
+from time import monotonic
+import aiofiles
+import aiohttp
+from aiohttp.payload import Payload
+import discord
+from .utils import keep_fresh
+
+__all__ = ("UploadError", "FilePayload", "multipart_form", "upload_file", "LITTERBOX_URL", "LITTERBOX_MAX_BYTES")
+
+"""
+This module uploads files to external hosts for the media commands.
+Files are streamed from disk in chunks rather than read into memory, and
+uploads that fail for reasons worth retrying (dropped connections, timeouts
+and 5xx or 429 responses) are tried again with exponential backoff.
+"""
+
+LITTERBOX_URL = getenv("LITTERBOX_URL", "https://litterbox.catbox.moe/resources/internals/api.php")
+LITTERBOX_MAX_BYTES = int(getenv("LITTERBOX_MAX_MB", 1000)) * 2**20
+CHUNK_SIZE = 256 * 2**10
+# the least time between progress reports, in seconds
+PROGRESS_INTERVAL = 3.0
+# a read timeout rather than a total one, big files take as long as they take
+TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=120)
+
+class UploadError(discord.errors.ApplicationCommandError):
+    pass
+
+class FilePayload(Payload):
+    """A file streamed from disk, reporting how much has been sent"""
+
+    def __init__(self, path: str, progress=None, progress_interval: float | None = None, **kwargs) -> None:
+        super().__init__(path, **kwargs)
+        self._size = os.path.getsize(path)
+        self.progress = progress
+        self.progress_interval = PROGRESS_INTERVAL if progress_interval is None else progress_interval
+        self.sent = 0
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        raise TypeError("A file payload can't be decoded")
+
+    async def write(self, writer) -> None:
+        reported = monotonic()
+        report: asyncio.Task | None = None
+        async with aiofiles.open(self._value, "rb") as file:
+            while chunk := await file.read(CHUNK_SIZE):
+                await writer.write(chunk)
+                self.sent += len(chunk)
+                # throttled, and never more than one report at a time so a slow edit can't hold up the upload
+                if self.progress and monotonic() - reported >= self.progress_interval and (report is None or report.done()):
+                    reported = monotonic()
+                    report = asyncio.create_task(self.progress(self.sent, self._size))
+        # so a late report can't land after whatever the caller shows next
+        if report is not None:
+            await report
+
+def multipart_form(path: str, filename: str, file_field: str, fields: dict, progress=None) -> aiohttp.MultipartWriter:
+    """A form-data body of these fields and the file, streamed when it's sent"""
+    form = aiohttp.MultipartWriter("form-data")
+    for name, value in fields.items():
+        form.append(str(value)).set_content_disposition("form-data", name=name)
+    payload = FilePayload(path, progress, filename=filename)
+    payload.set_content_disposition("form-data", name=file_field, filename=filename)
+    form.append_payload(payload)
+    return form
+
+async def upload_file(
+    session: aiohttp.ClientSession,
+    path: str,
+    filename: str,
+    url: str = LITTERBOX_URL,
+    fields: dict | None = None,
+    file_field: str = "fileToUpload",
+    max_bytes: int = LITTERBOX_MAX_BYTES,
+    progress=None,
+    attempts: int = 4,
+) -> str:
+    """Upload a file as multipart form data and return the response text"""
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        # don't send hundreds of megabytes just to be told no
+        raise UploadError(f"The file is {size / 2**20:.0f}MB, the host only takes up to {max_bytes / 2**20:.0f}MB")
+
+    async with keep_fresh(path):
+        for attempt in range(attempts):
+            retry_after = None
+            try:
+                # the form has to be made again each time, its file has been read
+                form = multipart_form(path, filename, file_field, fields or {}, progress)
+                async with session.post(url, data=form, timeout=TIMEOUT) as response:
+                    text = (await response.text()).strip()
+                    if response.ok:
+                        return text
+                    if response.status != 429 and response.status < 500:
+                        raise UploadError(f"Upload failed: {response.status} {text[:200]}")
+                    retry_after = response.headers.get("Retry-After")
+                    error = f"{response.status} {response.reason}"
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = str(e) or e.__class__.__name__
+            if attempt + 1 < attempts:
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt + random.random()
+                print(f"Upload of {filename} failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    raise UploadError(f"Upload failed after {attempts} attempts: {error}")
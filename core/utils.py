@@ -1,14 +1,17 @@
 from discord import DiscordException
 from discord.ext import commands
 from typing import Any, Literal
-import io
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import random
 import aiohttp
-from PIL import Image, UnidentifiedImageError
-from bs4 import BeautifulSoup as bs
 import discord
 import datetime
 from datetime import timedelta
-from core import models
+from functools import partial
+from core import ingest, models
 
 __all__ = (
     "s",
@@ -18,7 +21,12 @@ __all__ = (
     "Lowercase",
     "BotMissingPermissions",
     "image_or_url",
+    "image_bytes_or_url",
+    "decode_image",
     "log_data_to_csv",
+    "setup_logging",
+    "UserIndex",
+    "keep_fresh",
 )
 
 # functions
@@ -52,58 +60,91 @@ def humanize_time(time: timedelta) -> str:
         return f"{minutes} minute{s(minutes)} and {seconds} second{s(seconds)}"
     return f"{seconds} second{s(seconds)}"
 
-async def image_or_url(image, url):
-    """Return an image from an attachment or URL, including GIFs"""
-    async with aiohttp.ClientSession() as session:
-        try:
-            if image:
-                async with session.get(image.url) as response:
-                    response = await response.read()
-                    return Image.open(io.BytesIO(response))
-            if url:
-                #Process a link to get the media link from a webpage
-                async with session.get(url) as response:
-                    try:
-                        response.raise_for_status()
-                    except Exception as e:
-                        raise discord.errors.ApplicationCommandError(e)
-                    #use beautifulsoup to get parsed html and find the meta tag with the image
-                    try:
-                        soup = bs(await response.text(), "html.parser")
-                        meta = soup.find("meta", property="og:image")
-                        if meta:
-                            url = meta["content"]
-                            async with session.get(url) as response:
-                                response = await response.read()
-                                return Image.open(io.BytesIO(response))
-                        else:
-                            return Image.open(io.BytesIO(await response.read()))
-                    except UnicodeDecodeError:
-                        return Image.open(io.BytesIO(await response.read()))
-        except UnidentifiedImageError:
-            raise discord.errors.ApplicationCommandError("Invalid image")
+async def image_bytes_or_url(
+    session: aiohttp.ClientSession, image, url, policy: ingest.IngestPolicy = ingest.DEFAULT_POLICY
+) -> bytes:
+    """Return the undecoded bytes of an image from an attachment or URL"""
+    if not image and not url:
         raise discord.errors.ApplicationCommandError("No image or URL provided")
+    data = None
+    if isinstance(image, discord.Attachment) and (resized := ingest.resized_url(image, policy)):
+        # a scaled down copy is far less to download and decode, but fall back to the original
+        try:
+            data = await ingest.fetch_media(session, resized, follow_page=False)
+        except (aiohttp.ClientError, discord.errors.ApplicationCommandError):
+            pass
+    try:
+        # attachments are always media, links may be a web page with an og:image
+        data = data or await ingest.fetch_media(session, image.url if image else url, follow_page=not image)
+    except aiohttp.ClientError as e:
+        raise discord.errors.ApplicationCommandError(f"Failed to fetch media: {e}")
+    return data
+
+async def decode_image(data: bytes, policy: ingest.IngestPolicy = ingest.DEFAULT_POLICY):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(ingest.open_image, data, policy))
+
+async def image_or_url(session: aiohttp.ClientSession, image, url, policy: ingest.IngestPolicy = ingest.DEFAULT_POLICY):
+    """Return an image from an attachment or URL, including GIFs"""
+    return await decode_image(await image_bytes_or_url(session, image, url, policy), policy)
+
+@asynccontextmanager
+async def keep_fresh(*paths: str, interval: float = 60):
+    """Keep touching temporary files while they're in use, so the temp cleaner leaves them alone"""
+    def touch() -> None:
+        for path in paths:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    async def keep_touching() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            touch()
+
+    # fresh from the start, whatever age the file was made with
+    touch()
+    task = asyncio.create_task(keep_touching())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+def setup_logging(debug: bool, filename: str = "discord.log") -> None:
+    logger = logging.getLogger("discord")
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    handler = logging.FileHandler(
+        filename=filename, encoding="utf-8", mode="w"
+    )
+    handler.formatter = logging.Formatter(
+        "[%(asctime)s %(levelname)s] %(name)s: %(message)s",
+        "%d/%m/%y %H:%M:%S",
+    )
+    logger.addHandler(handler)
 
 async def log_data(bot):
     # get stats
-    date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-    time = datetime.datetime.utcnow().strftime("%H:%M:%S")
-    user_count = len(bot.users)
-    guild_count = len(bot.guilds)
-    guild_member_total = sum([guild.member_count for guild in bot.guilds])
-
-    user_data_list = await models.UserModel.all()
-    total_command_count = 0
-    active_users = 0
-    for user_data in user_data_list:
-        total_command_count += user_data.commands_used or 0
-        if user_data.commands_used:
-            active_users += 1
-
-    # write data to database
-    await models.StatsModel.create(
-        date=date,
-        time=time,
+    now = datetime.datetime.utcnow()
+    # totals across every cluster when the bot is clustered
+    bot_totals = bot.get_totals()
+    guild_count = bot_totals["guild_count"]
+    guild_member_total = bot_totals["guild_member_total"]
+
+    totals = await models.UserModel.get_command_totals()
+    total_command_count = totals["total_command_count"]
+    active_users = totals["active_users"]
+    if bot.lean_cache or "user_count" not in bot_totals:
+        # the user cache is nearly empty in lean mode, and can't be summed across clusters,
+        # so count the users the bot knows of instead
+        user_count = totals["user_count"]
+    else:
+        user_count = bot_totals["user_count"]
+
+    # write data to database, this also updates the daily and weekly rollups
+    await models.StatsModel.record(
+        date=now.date(),
+        time=now.time().replace(microsecond=0),
         user_count=user_count,
         guild_count=guild_count,
         total_command_count=total_command_count,
@@ -118,6 +159,61 @@ class _Lowercase(commands.Converter):
 
 Lowercase: Any = _Lowercase()
 
+# indexes
+class UserIndex:
+    """The ids of the users the bot shares a guild with, for sampling in constant time"""
+
+    def __init__(self) -> None:
+        # ids rather than users, so the index never keeps a member alive
+        self.users: list[int] = []
+        # where each user is in the list, and how many guilds they were seen in
+        self.positions: dict[int, int] = {}
+        self.refs: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def clear(self) -> None:
+        self.users.clear()
+        self.positions.clear()
+        self.refs.clear()
+
+    def add(self, user: discord.abc.User) -> None:
+        if user.bot:
+            return
+        if user.id in self.refs:
+            self.refs[user.id] += 1
+            return
+        self.refs[user.id] = 1
+        self.positions[user.id] = len(self.users)
+        self.users.append(user.id)
+
+    def remove(self, user_id: int) -> None:
+        if user_id not in self.refs:
+            return
+        self.refs[user_id] -= 1
+        if self.refs[user_id]:
+            return
+        del self.refs[user_id]
+        # move the last user into the gap so the list stays dense
+        position = self.positions.pop(user_id)
+        last = self.users.pop()
+        if last != user_id:
+            self.users[position] = last
+            self.positions[last] = position
+
+    def sample(self, exclude: tuple[int, ...] = ()) -> int | None:
+        """Pick a user id uniformly at random, never one of the excluded ids"""
+        skipped = sorted(self.positions[user_id] for user_id in set(exclude) if user_id in self.positions)
+        if len(self.users) <= len(skipped):
+            return None
+        # pick from the positions that are left, then step over the skipped ones
+        index = random.randrange(len(self.users) - len(skipped))
+        for position in skipped:
+            if position <= index:
+                index += 1
+        return self.users[index]
+
 # exceptions
 class BotMissingPermissions(DiscordException):
     def __init__(self, permissions) -> None:
@@ -1,7 +1,11 @@
+from time import perf_counter
+started = perf_counter()
+
 from argparse import ArgumentParser
 from dotenv import load_dotenv
-import logging
 from core import Bot
+from core.cluster import Supervisor
+from core.utils import setup_logging
 
 if __name__ == "__main__":
     parser = ArgumentParser(prog="Bot")
@@ -19,21 +23,35 @@ if __name__ == "__main__":
         action="store_true",
         help="synchronize commands",
     )
+    parser.add_argument(
+        "-c",
+        "--clusters",
+        type=int,
+        default=1,
+        help="run the shards across this many processes",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="total shard count when clustered (default: discord's recommendation)",
+    )
     args = parser.parse_args()
     debug = args.cogs is not None
 
     load_dotenv(".env")
 
-    logger = logging.getLogger("discord")
-    logger.setLevel(logging.DEBUG if debug else logging.INFO)
-    handler = logging.FileHandler(
-        filename="discord.log", encoding="utf-8", mode="w"
-    )
-    handler.formatter = logging.Formatter(
-        "[%(asctime)s %(levelname)s] %(name)s: %(message)s",
-        "%d/%m/%y %H:%M:%S",
-    )
-    logger.addHandler(handler)
-    
+    if args.clusters > 1:
+        # the clusters log to their own files, this one has the restarts and crashes
+        setup_logging(debug, filename="discord-supervisor.log")
+        Supervisor(
+            args.clusters, args.shards, debug=debug, cogs=args.cogs, sync=args.sync
+        ).run()
+        raise SystemExit
+
+    setup_logging(debug)
+
+    imports = perf_counter() - started
     bot = Bot()
+    bot.startup_times["imports"] = imports
     bot.run(debug=debug, cogs=args.cogs, sync=args.sync)
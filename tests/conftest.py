@@ -0,0 +1,17 @@
+"""
+Point the bot's external hosts at local stand-ins for the tests.
+Hosts are read from the environment when their core module is imported, and
+importing any one of them imports the rest, so these are set here, before
+any test module is collected.
+"""
+import os
+import socket
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+os.environ["LITTERBOX_URL"] = f"http://127.0.0.1:{free_port()}/api.php"
+os.environ["MEDIA_PROXY_BASE"] = f"http://127.0.0.1:{free_port()}"
+os.environ["IMGUR_API_URL"] = f"http://127.0.0.1:{free_port()}/3"
@@ -0,0 +1,139 @@
+"""
+Test the Imgur uploader (see core/imgur.py) against a local stand-in for
+the Imgur API, pointed at with IMGUR_API_URL.
+
+Usage: python -m pytest tests
+"""
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+from aiohttp import ClientSession, web
+from core import imgur
+
+# conftest.py points IMGUR_API_URL here
+PORT = urlsplit(imgur.API_URL).port
+LINK = "https://i.imgur.com/abc123.mp4"
+
+@asynccontextmanager
+async def imgur_api(responses: list):
+    """Serve a stand-in for the Imgur API that gives these (status, headers) responses in turn"""
+    received = []
+
+    async def handle(request: web.Request) -> web.Response:
+        fields = {}
+        async for part in await request.multipart():
+            fields[part.name] = part.filename if part.filename else await part.text()
+        received.append({"authorization": request.headers.get("Authorization"), "fields": fields})
+        status, headers = responses.pop(0) if responses else (200, {})
+        if status == 200:
+            body = {"data": {"link": LINK}, "success": True, "status": status}
+        else:
+            body = {"data": {"error": "Upload failed"}, "success": False, "status": status}
+        return web.json_response(body, status=status, headers=headers)
+
+    app = web.Application(client_max_size=2**30)
+    app.router.add_post("/3/upload", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    try:
+        yield received
+    finally:
+        await runner.cleanup()
+
+@pytest.fixture
+def video(tmp_path) -> str:
+    path = tmp_path / "video.mp4"
+    path.write_bytes(os.urandom(2**16))
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def client(monkeypatch) -> None:
+    monkeypatch.setenv("IMGUR_CLIENT_ID", "client-id")
+    # every test starts knowing nothing about the credits left
+    monkeypatch.setattr(imgur, "limits", imgur.RateLimits())
+
+@pytest.fixture
+def slept(monkeypatch) -> list:
+    """The delays the uploader asks for, without waiting them out"""
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record(delay: float) -> None:
+        delays.append(delay)
+        await sleep(0)
+
+    # only the uploader's view of asyncio, so the server and client still run as normal
+    monkeypatch.setattr(imgur, "asyncio", SimpleNamespace(sleep=record, TimeoutError=asyncio.TimeoutError))
+    return delays
+
+def run_upload(video: str, responses: list):
+    async def run():
+        async with imgur_api(responses) as received:
+            async with ClientSession() as session:
+                try:
+                    return await imgur.upload(session, video, title="clip"), received
+                except imgur.ImgurError as error:
+                    return error, received
+
+    return asyncio.run(run())
+
+def test_upload(video, slept):
+    link, received = run_upload(video, [])
+    assert link == LINK
+    assert received == [{
+        "authorization": "Client-ID client-id",
+        "fields": {"type": "file", "title": "clip", "video": "video.mp4"},
+    }]
+    assert slept == []
+
+def test_rate_limited_waits_for_the_credits_to_come_back(video, slept):
+    user_reset = int(time.time()) + 3600
+    link, received = run_upload(video, [(429, {
+        "X-RateLimit-ClientRemaining": "12000",
+        "X-RateLimit-UserRemaining": "500",
+        "X-RateLimit-UserReset": str(user_reset),
+        "X-Post-Rate-Limit-Remaining": "0",
+        "X-Post-Rate-Limit-Reset": "5",
+    })])
+    assert link == LINK
+    assert len(received) == 2
+    assert imgur.limits.client_remaining == 12000
+    assert imgur.limits.user_remaining == 500
+    assert imgur.limits.user_reset == user_reset
+    assert imgur.limits.post_remaining == 0
+    # no backoff on top, the wait is for when the headers say the credits are back
+    assert slept[0] == 0
+    assert 4 < slept[1] <= 5
+
+def test_server_errors_are_retried_with_backoff(video, slept):
+    link, received = run_upload(video, [(503, {}), (502, {})])
+    assert link == LINK
+    assert len(received) == 3
+    assert 1 <= slept[0] < 2
+    assert 2 <= slept[1] < 3
+
+def test_client_errors_are_not_retried(video, slept):
+    error, received = run_upload(video, [(400, {})])
+    assert isinstance(error, imgur.ImgurError)
+    assert "400 Upload failed" in str(error)
+    assert len(received) == 1
+    assert slept == []
+
+def test_no_request_once_client_credits_run_out(video, slept):
+    error, received = run_upload(video, [(429, {"X-RateLimit-ClientRemaining": "0"})])
+    assert isinstance(error, imgur.ImgurError)
+    assert "for today" in str(error)
+    assert len(received) == 1
+
+    error, received = run_upload(video, [])
+    assert "for today" in str(error)
+    assert received == []
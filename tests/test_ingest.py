@@ -0,0 +1,107 @@
+"""
+Test fetching attachments through the media proxy (see core/ingest.py and
+core/utils.py) against a local stand-in for Discord's CDN and media proxy,
+pointed at with MEDIA_PROXY_BASE.
+
+Usage: python -m pytest tests
+"""
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+import asyncio
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+from aiohttp import ClientSession, web
+from PIL import Image
+from core import ingest, utils
+
+# conftest.py points MEDIA_PROXY_BASE here, the original files are served from the same place
+PORT = urlsplit(ingest.MEDIA_PROXY).port
+POLICY = ingest.IngestPolicy(max_side=1024)
+
+def png(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, "PNG")
+    return output.getvalue()
+
+ORIGINAL = png(400, 200)
+RESIZED = png(40, 20)
+
+@asynccontextmanager
+async def discord_cdn(proxy_status: int = 200):
+    """Serve the original under /original and the proxy's scaled copies under /attachments, yielding the requests made"""
+    received = []
+
+    async def original(request: web.Request) -> web.Response:
+        received.append(("original", dict(request.query)))
+        return web.Response(body=ORIGINAL, content_type="image/png")
+
+    async def proxy(request: web.Request) -> web.Response:
+        received.append(("proxy", dict(request.query)))
+        if proxy_status != 200:
+            return web.Response(status=proxy_status, text="proxy error")
+        return web.Response(body=RESIZED, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/original/{path:.*}", original)
+    app.router.add_get("/attachments/{path:.*}", proxy)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    try:
+        yield received
+    finally:
+        await runner.cleanup()
+
+def attachment(width: int = 4000, height: int = 2000, content_type: str = "image/png") -> discord.Attachment:
+    return discord.Attachment(
+        data={
+            "id": 1,
+            "size": len(ORIGINAL),
+            "filename": "image.png",
+            "url": f"http://127.0.0.1:{PORT}/original/image.png?ex=abc&hm=def&",
+            "proxy_url": "https://media.discordapp.net/attachments/1/2/image.png?ex=abc&hm=def&",
+            "width": width,
+            "height": height,
+            "content_type": content_type,
+        },
+        state=SimpleNamespace(http=None),
+    )
+
+def fetch(image: discord.Attachment, proxy_status: int = 200):
+    async def run():
+        async with discord_cdn(proxy_status) as received:
+            async with ClientSession() as session:
+                return await utils.image_bytes_or_url(session, image, None, POLICY), received
+
+    return asyncio.run(run())
+
+def test_resized_url_keeps_the_signature():
+    url = ingest.resized_url(attachment(), POLICY)
+    assert url == f"{ingest.MEDIA_PROXY}/attachments/1/2/image.png?ex=abc&hm=def&width=1024&height=512"
+
+def test_resized_url_skips_what_the_proxy_cant_scale():
+    # already small enough, or an animation the proxy would flatten
+    assert ingest.resized_url(attachment(800, 600), POLICY) is None
+    assert ingest.resized_url(attachment(content_type="image/gif"), POLICY) is None
+
+def test_attachments_are_fetched_scaled_down():
+    data, received = fetch(attachment())
+    assert data == RESIZED
+    assert received == [("proxy", {"ex": "abc", "hm": "def", "width": "1024", "height": "512"})]
+
+def test_falls_back_to_the_original_when_the_proxy_fails():
+    data, received = fetch(attachment(), proxy_status=502)
+    assert data == ORIGINAL
+    assert [name for name, _ in received] == ["proxy", "original"]
+    assert received[1][1] == {"ex": "abc", "hm": "def"}
+
+def test_small_attachments_skip_the_proxy():
+    data, received = fetch(attachment(400, 200))
+    assert data == ORIGINAL
+    assert [name for name, _ in received] == ["original"]
@@ -0,0 +1,69 @@
+"""
+Test the image commands (see cogs/media.py) on inputs served from a local
+stand-in for a media host.
+
+Usage: python -m pytest tests
+"""
+from contextlib import asynccontextmanager
+import asyncio
+import io
+import os
+import socket
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+import pytest
+from aiohttp import ClientSession, web
+from PIL import Image
+from cogs import media
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@asynccontextmanager
+async def host(body: bytes, content_type: str):
+    """Serve a stand-in media host that gives this file for any path, and yield its URL"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=body, content_type=content_type)
+
+    port = free_port()
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        yield f"http://127.0.0.1:{port}/image"
+    finally:
+        await runner.cleanup()
+
+@pytest.fixture
+def oversized_gif() -> bytes:
+    frames = [Image.new("RGB", (2400, 1600), color) for color in ("red", "green", "blue")]
+    output = io.BytesIO()
+    frames[0].save(output, "GIF", save_all=True, append_images=frames[1:], duration=100)
+    return output.getvalue()
+
+def test_speech_bubble_scales_animated_inputs(oversized_gif, monkeypatch):
+    # the overlay is opened relative to the repo root
+    monkeypatch.chdir(ROOT)
+
+    async def run():
+        async with host(oversized_gif, "image/gif") as url:
+            async with ClientSession() as session:
+                return await media.speech_bubble(session, None, url, 3, format="png")
+
+    file = asyncio.run(run())
+    try:
+        with Image.open(file.fp.name) as output:
+            size = output.size
+    finally:
+        file.close()
+        os.remove(file.fp.name)
+    # the first frame is composited at the working resolution, not at full size
+    assert max(size) == media.SPEECH_BUBBLE_POLICY.max_side
+    assert size == (1024, 683)
@@ -0,0 +1,112 @@
+"""
+Test the litterbox uploader (see core/upload.py) against a local stand-in
+for litterbox, pointed at with LITTERBOX_URL.
+
+Usage: python -m pytest tests
+"""
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+from aiohttp import ClientSession, web
+from core import upload
+
+LINK = "https://litter.catbox.moe/abc123.mp4"
+# conftest.py points LITTERBOX_URL here
+PORT = urlsplit(upload.LITTERBOX_URL).port
+
+@asynccontextmanager
+async def litterbox(responses: list):
+    """Serve a stand-in for litterbox that gives these (status, headers, body) responses in turn"""
+    received = []
+
+    async def handle(request: web.Request) -> web.Response:
+        fields = {}
+        async for part in await request.multipart():
+            if part.filename:
+                fields[part.name] = (part.filename, len(await part.read()))
+            else:
+                fields[part.name] = await part.text()
+        received.append({"fields": fields, "content_length": request.content_length})
+        status, headers, body = responses.pop(0) if responses else (200, {}, LINK)
+        return web.Response(status=status, headers=headers, text=body)
+
+    app = web.Application(client_max_size=2**30)
+    app.router.add_post("/api.php", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    try:
+        yield received
+    finally:
+        await runner.cleanup()
+
+@pytest.fixture
+def video(tmp_path) -> str:
+    path = tmp_path / "video.mp4"
+    path.write_bytes(os.urandom(2**20 + 5))
+    return str(path)
+
+def test_retries_after_a_server_error(video):
+    async def run():
+        async with litterbox([(503, {"Retry-After": "0"}, "busy")]) as received:
+            async with ClientSession() as session:
+                link = await upload.upload_file(
+                    session, video, "file.mp4", fields={"reqtype": "fileupload", "time": "72h"}
+                )
+        return link, received
+
+    link, received = asyncio.run(run())
+    assert link == LINK
+    assert len(received) == 2
+    # the whole file is sent again, streamed with a known length
+    assert received[1]["fields"] == {
+        "reqtype": "fileupload",
+        "time": "72h",
+        "fileToUpload": ("file.mp4", os.path.getsize(video)),
+    }
+    assert received[1]["content_length"] is not None
+
+def test_client_errors_are_not_retried(video):
+    async def run():
+        async with litterbox([(400, {}, "bad request")]) as received:
+            with pytest.raises(upload.UploadError, match="400"):
+                async with ClientSession() as session:
+                    await upload.upload_file(session, video, "file.mp4")
+        return received
+
+    assert len(asyncio.run(run())) == 1
+
+def test_progress_is_reported(video, monkeypatch):
+    monkeypatch.setattr(upload, "PROGRESS_INTERVAL", 0)
+    reports = []
+
+    async def progress(sent: int, total: int) -> None:
+        reports.append((sent, total))
+
+    async def run():
+        async with litterbox([]):
+            async with ClientSession() as session:
+                return await upload.upload_file(session, video, "file.mp4", progress=progress)
+
+    assert asyncio.run(run()) == LINK
+    size = os.path.getsize(video)
+    assert reports
+    assert [sent for sent, _ in reports] == sorted(sent for sent, _ in reports)
+    assert all(total == size for _, total in reports)
+    assert reports[-1][0] <= size
+
+def test_files_over_the_limit_are_refused_before_sending(video):
+    async def run():
+        async with litterbox([]) as received:
+            with pytest.raises(upload.UploadError, match="only takes up to"):
+                async with ClientSession() as session:
+                    await upload.upload_file(session, video, "file.mp4", max_bytes=2**20)
+        return received
+
+    assert asyncio.run(run()) == []